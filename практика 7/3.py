@@ -1,48 +1,181 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 from matplotlib.patches import Circle
 import matplotlib.animation as animation
 from matplotlib.widgets import Slider, Button
+from scipy.spatial import KDTree
+
+K_COULOMB = 9e9  # Константа Кулона
+MIN_DISTANCE = 0.1  # Минимальное расстояние до заряда (избегаем деления на ноль)
+
+
+def coulomb_field(charges, X, Y, max_block_elements=1_000_000, dtype=np.float64):
+    """Поле и потенциал набора зарядов в точках X, Y.
+    
+    Все заряды обрабатываются сразу через broadcasting NumPy, но блоками,
+    чтобы промежуточные массивы (заряды x точки) не превышали max_block_elements.
+    Расчет и результат - в типе dtype (float32 вдвое экономит память).
+    """
+    charges = np.asarray(charges, dtype=dtype).reshape(-1, 3)
+    X = np.asarray(X, dtype=dtype)
+    Y = np.asarray(Y, dtype=dtype)
+    shape = np.broadcast_shapes(X.shape, Y.shape)
+    
+    Ex = np.zeros(shape, dtype=dtype)
+    Ey = np.zeros(shape, dtype=dtype)
+    potential = np.zeros(shape, dtype=dtype)
+    
+    # Сколько зарядов помещается в один блок
+    block = max(1, max_block_elements // max(1, int(np.prod(shape))))
+    expand = (slice(None),) + (np.newaxis,) * len(shape)
+    
+    for start in range(0, len(charges), block):
+        x0, y0, q = charges[start:start + block].T
+        kq = (K_COULOMB * q).astype(dtype)
+        
+        # Вектора от зарядов блока до точек: (заряды, *shape)
+        dx = X - x0[expand]
+        dy = Y - y0[expand]
+        
+        # Обратное расстояние с ограничением снизу (r >= MIN_DISTANCE)
+        inv_r = dx * dx + dy * dy
+        np.maximum(inv_r, MIN_DISTANCE ** 2, out=inv_r)
+        np.sqrt(inv_r, out=inv_r)
+        np.reciprocal(inv_r, out=inv_r)
+        
+        # Суммирование по зарядам - свертка по первой оси
+        potential += np.tensordot(kq, inv_r, axes=1)
+        
+        inv_r3 = inv_r * inv_r
+        inv_r3 *= inv_r
+        Ex += np.tensordot(kq, dx * inv_r3, axes=1)
+        Ey += np.tensordot(kq, dy * inv_r3, axes=1)
+    
+    return Ex, Ey, potential
+
 
 class ElectricFieldSimulator:
-    def __init__(self):
+    def __init__(self, grid_size=100, x_range=(-5, 5), y_range=(-5, 5),
+                 dtype=np.float64, materialize_grid=True, seed=None):
         self.charges = []  # Список зарядов: (x, y, q)
-        self.grid_size = 100
-        self.x_range = (-5, 5)
-        self.y_range = (-5, 5)
+        self.version = 0   # Версия состояния: растет при любом изменении полей
+        
+        # Собственный генератор для случайных конфигураций зарядов
+        self.rng = np.random.default_rng(seed)
+        self.grid_size = grid_size
+        self.x_range = x_range
+        self.y_range = y_range
+        
+        # Тип массивов сетки и полей (np.float32 - вдвое меньше памяти)
+        self.dtype = np.dtype(dtype).type
+        # False - вместо полных meshgrid хранить X, Y как строку и столбец,
+        # которые NumPy расширяет до сетки только при вычислениях
+        self.materialize_grid = materialize_grid
+        
+        # Ограничение на размер промежуточных массивов при расчете
+        self.max_block_elements = 1_000_000
+        
+        # Метод расчета: 'direct' (точная сумма) или 'barnes_hut' (дерево зарядов)
+        self.field_method = 'direct'
+        self.theta = 0.5  # Угол раскрытия для Barnes-Hut: меньше - точнее
         
         # Создаем сетку для расчета поля
-        self.x = np.linspace(self.x_range[0], self.x_range[1], self.grid_size)
-        self.y = np.linspace(self.y_range[0], self.y_range[1], self.grid_size)
-        self.X, self.Y = np.meshgrid(self.x, self.y)
+        self._set_grid(np.linspace(self.x_range[0], self.x_range[1], self.grid_size),
+                       np.linspace(self.y_range[0], self.y_range[1], self.grid_size))
+    
+    def _set_grid(self, x, y):
+        """Задать оси сетки и обнулить поля"""
+        # Оси малы и остаются float64: в float32 шаг linspace перестает быть
+        # строго равномерным, и streamplot отвергает такую сетку
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+        self.grid_size = len(self.x)
+        
+        if self.materialize_grid:
+            self.X, self.Y = np.meshgrid(self.x.astype(self.dtype), self.y.astype(self.dtype))
+        else:
+            self.X = self.x[np.newaxis, :]
+            self.Y = self.y[:, np.newaxis]
         
         # Инициализируем поля
-        self.Ex = np.zeros_like(self.X)
-        self.Ey = np.zeros_like(self.Y)
-        self.potential = np.zeros_like(self.X)
+        shape = (len(self.y), len(self.x))
+        self.Ex = np.zeros(shape, dtype=self.dtype)
+        self.Ey = np.zeros(shape, dtype=self.dtype)
+        self.potential = np.zeros(shape, dtype=self.dtype)
+        self.version += 1
+    
+    def memory_usage(self):
+        """Память, занимаемая массивами сетки и полей, в байтах"""
+        arrays = [self.x, self.y, self.Ex, self.Ey, self.potential]
+        if self.materialize_grid:
+            arrays += [self.X, self.Y]
+        return sum(a.nbytes for a in arrays)
         
     def add_charge(self, x, y, q):
         """Добавить точечный заряд"""
         self.charges.append((x, y, q))
-        self.calculate_field()
+        # Поле линейно: достаточно добавить вклад одного нового заряда
+        self._apply_charge(x, y, q, sign=1)
         
     def remove_charge(self, index):
         """Удалить заряд по индексу"""
         if 0 <= index < len(self.charges):
-            self.charges.pop(index)
-            self.calculate_field()
+            x, y, q = self.charges.pop(index)
+            self._apply_charge(x, y, q, sign=-1)
     
     def clear_charges(self):
         """Очистить все заряды"""
         self.charges.clear()
-        self.calculate_field()
+        self.Ex = np.zeros_like(self.Ex)
+        self.Ey = np.zeros_like(self.Ey)
+        self.potential = np.zeros_like(self.potential)
+        self.version += 1
+    
+    def _apply_charge(self, x, y, q, sign):
+        """Добавить (sign=1) или вычесть (sign=-1) вклад одного заряда в поле"""
+        Ex, Ey, potential = coulomb_field(
+            [(x, y, sign * q)], self.x[np.newaxis, :], self.y[:, np.newaxis], dtype=self.dtype)
+        self.Ex += Ex
+        self.Ey += Ey
+        self.potential += potential
+        self.version += 1
+    
+    def random_charges(self, n, q_range=(-2, 2), margin=1.0):
+        """Случайные заряды (x, y, q) внутри области из генератора симулятора"""
+        x = self.rng.uniform(self.x_range[0] + margin, self.x_range[1] - margin, n)
+        y = self.rng.uniform(self.y_range[0] + margin, self.y_range[1] - margin, n)
+        q = self.rng.uniform(q_range[0], q_range[1], n)
+        return list(zip(x, y, q))
     
     def calculate_field(self):
-        """Рассчитать электрическое поле и потенциал"""
+        """Рассчитать электрическое поле и потенциал (все заряды сразу)"""
+        self.version += 1
+        if self.field_method == 'barnes_hut':
+            tree = ChargeTree(self.charges)
+            Ex, Ey, potential = tree.field(self.X, self.Y, self.theta)
+            self.Ex = Ex.astype(self.dtype, copy=False)
+            self.Ey = Ey.astype(self.dtype, copy=False)
+            self.potential = potential.astype(self.dtype, copy=False)
+            return
+        
+        # Передаем одномерные оси: dx и dy считаются один раз на строку/столбец,
+        # а полная сетка появляется только при сложении квадратов
+        self.Ex, self.Ey, self.potential = coulomb_field(
+            self.charges, self.x[np.newaxis, :], self.y[:, np.newaxis],
+            self.max_block_elements, self.dtype)
+    
+    def calculate_field_loop(self):
+        """Исходный расчет поля циклом по зарядам (эталон для сравнения)"""
+        self.version += 1
         # Сбрасываем поля
-        self.Ex = np.zeros_like(self.X)
-        self.Ey = np.zeros_like(self.Y)
-        self.potential = np.zeros_like(self.X)
+        self.Ex = np.zeros_like(self.Ex)
+        self.Ey = np.zeros_like(self.Ey)
+        self.potential = np.zeros_like(self.potential)
         
         k = 9e9  # Константа Кулона
         
@@ -73,30 +206,309 @@ class ElectricFieldSimulator:
             # Электрический потенциал
             self.potential += k * q / r
     
+    def calculate_field_adaptive(self, max_depth=8, tol=0.01):
+        """Рассчитать поле на адаптивной сетке и заменить им равномерную сетку"""
+        grid = AdaptiveFieldGrid(self, max_depth=max_depth, tol=tol)
+        x, y, Ex, Ey, potential = grid.resample()
+        self._set_grid(x, y)  # Заодно увеличивает версию
+        self.Ex[:] = Ex
+        self.Ey[:] = Ey
+        self.potential[:] = potential
+        return grid
+    
+    def get_field_at_points(self, xs, ys):
+        """Получить поле сразу во множестве точек (все точки и заряды за один проход)"""
+        Ex, Ey, _ = coulomb_field(self.charges, xs, ys, self.max_block_elements)
+        return Ex, Ey
+    
     def get_field_at_point(self, x, y):
         """Получить поле в конкретной точке"""
-        Ex_point, Ey_point = 0, 0
+        Ex_point, Ey_point = self.get_field_at_points(x, y)
+        return float(Ex_point), float(Ey_point)
+
+class ChargeTree:
+    """Квадродерево зарядов для приближенного расчета поля (Barnes-Hut).
+    
+    Каждый узел хранит суммарный заряд и дипольный момент относительно своего
+    центра. Если узел виден из точки под малым углом (width / d < theta),
+    его вклад считается по мультипольному разложению, иначе - по детям,
+    а в листьях - прямым суммированием.
+    """
+    def __init__(self, charges, leaf_size=16, max_depth=32):
+        self.charges = np.asarray(charges, dtype=float).reshape(-1, 3)
+        self.leaf_size = leaf_size
+        self.max_depth = max_depth
+        
+        # Узлы дерева хранятся в параллельных списках
+        self.centers = []    # Центр разложения (центр масс |q|)
+        self.widths = []     # Размер ячейки
+        self.total_q = []    # Суммарный заряд
+        self.dipoles = []    # Дипольный момент относительно центра
+        self.children = []   # Индексы дочерних узлов
+        self.members = []    # Индексы зарядов листа (None для внутренних узлов)
+        
+        if len(self.charges):
+            xy = self.charges[:, :2]
+            lower = xy.min(axis=0)
+            width = max(np.max(xy.max(axis=0) - lower), MIN_DISTANCE)
+            self._build(np.arange(len(self.charges)), lower, width, 0)
+    
+    def _build(self, idx, lower, width, depth):
+        """Рекурсивное построение узла для зарядов idx в ячейке [lower, lower + width]"""
+        node = len(self.centers)
+        x, y, q = self.charges[idx].T
+        weight = np.abs(q)
+        if weight.sum() > 0:
+            center = np.array([np.average(x, weights=weight), np.average(y, weights=weight)])
+        else:
+            center = lower + width / 2
+        
+        self.centers.append(center)
+        self.widths.append(width)
+        self.total_q.append(q.sum())
+        self.dipoles.append(np.array([np.sum(q * (x - center[0])), np.sum(q * (y - center[1]))]))
+        self.children.append([])
+        self.members.append(None)
+        
+        if len(idx) <= self.leaf_size or depth >= self.max_depth:
+            self.members[node] = idx
+            return node
+        
+        half = width / 2
+        right = x >= lower[0] + half
+        top = y >= lower[1] + half
+        for quad_right in (False, True):
+            for quad_top in (False, True):
+                mask = (right == quad_right) & (top == quad_top)
+                if np.any(mask):
+                    child_lower = lower + half * np.array([quad_right, quad_top])
+                    child = self._build(idx[mask], child_lower, half, depth + 1)
+                    self.children[node].append(child)
+        return node
+    
+    def field(self, X, Y, theta=0.5):
+        """Поле и потенциал в точках X, Y с параметром точности theta"""
+        X = np.asarray(X, dtype=float)
+        Y = np.asarray(Y, dtype=float)
+        shape = np.broadcast_shapes(X.shape, Y.shape)
+        X = np.broadcast_to(X, shape).ravel()
+        Y = np.broadcast_to(Y, shape).ravel()
+        
+        Ex = np.zeros(X.size)
+        Ey = np.zeros(X.size)
+        potential = np.zeros(X.size)
+        if self.centers:
+            self._accumulate(0, np.arange(X.size), X, Y, theta, Ex, Ey, potential)
+        return Ex.reshape(shape), Ey.reshape(shape), potential.reshape(shape)
+    
+    def _accumulate(self, node, idx, X, Y, theta, Ex, Ey, potential):
+        """Добавить вклад узла в точках idx (все точки узла обрабатываются вместе)"""
+        cx, cy = self.centers[node]
+        width = self.widths[node]
+        dx = X[idx] - cx
+        dy = Y[idx] - cy
+        d2 = dx * dx + dy * dy
+        
+        # Далекие точки: узел виден под малым углом и вне зоны ограничения r
+        far = (width * width < theta * theta * d2) & (d2 > (MIN_DISTANCE + width) ** 2)
+        if np.any(far):
+            dx_far, dy_far, d2_far = dx[far], dy[far], d2[far]
+            inv_d = 1.0 / np.sqrt(d2_far)
+            inv_d3 = inv_d ** 3
+            Q = self.total_q[node]
+            px, py = self.dipoles[node]
+            p_dot_r = px * dx_far + py * dy_far
+            
+            # Монополь + диполь
+            target = idx[far]
+            potential[target] += K_COULOMB * (Q * inv_d + p_dot_r * inv_d3)
+            radial = K_COULOMB * (Q * inv_d3 + 3 * p_dot_r * inv_d3 * inv_d * inv_d)
+            Ex[target] += radial * dx_far - K_COULOMB * px * inv_d3
+            Ey[target] += radial * dy_far - K_COULOMB * py * inv_d3
+        
+        near = idx[~far]
+        if not len(near):
+            return
         
-        k = 9e9
-        for charge in self.charges:
-            x0, y0, q = charge
+        if self.members[node] is not None:
+            # Лист: прямое суммирование по его зарядам
+            Ex_near, Ey_near, potential_near = coulomb_field(
+                self.charges[self.members[node]], X[near], Y[near])
+            Ex[near] += Ex_near
+            Ey[near] += Ey_near
+            potential[near] += potential_near
+        else:
+            for child in self.children[node]:
+                self._accumulate(child, near, X, Y, theta, Ex, Ey, potential)
+
+class AdaptiveFieldGrid:
+    """Адаптивная сетка (квадродерево) для расчета поля.
+    
+    Ячейки делятся вблизи зарядов и там, где билинейная интерполяция по углам
+    плохо приближает значение в центре ячейки. Узлы всех уровней лежат на
+    общей мелкой решетке (2**max_depth + 1 точек по оси), поле считается
+    только в реально используемых узлах.
+    """
+    def __init__(self, simulator, max_depth=8, base_depth=3, tol=0.01, near_factor=2.0):
+        self.simulator = simulator
+        self.max_depth = max_depth
+        self.base_depth = base_depth
+        self.tol = tol
+        self.near_factor = near_factor
+        
+        n = 2 ** max_depth + 1
+        self.x = np.linspace(simulator.x_range[0], simulator.x_range[1], n)
+        self.y = np.linspace(simulator.y_range[0], simulator.y_range[1], n)
+        
+        # Значения в узлах решетки (NaN - узел не вычислялся)
+        self.Ex = np.full((n, n), np.nan)
+        self.Ey = np.full((n, n), np.nan)
+        self.potential = np.full((n, n), np.nan)
+        
+        # Листья дерева: левый нижний узел (ix, iy) и размер ячейки в узлах
+        self.leaves = []
+        
+        self.build()
+    
+    @property
+    def evaluated_points(self):
+        """Количество узлов, в которых поле было вычислено"""
+        return int(np.count_nonzero(~np.isnan(self.potential)))
+    
+    def _evaluate(self, ix, iy):
+        """Вычислить поле в узлах решетки, которые еще не считались"""
+        missing = np.isnan(self.potential[iy, ix])
+        if not np.any(missing):
+            return
+        ix, iy = ix[missing], iy[missing]
+        # Один и тот же узел может принадлежать нескольким ячейкам
+        nodes = np.unique(np.column_stack([ix, iy]), axis=0)
+        ix, iy = nodes[:, 0], nodes[:, 1]
+        Ex, Ey, potential = coulomb_field(self.simulator.charges, self.x[ix], self.y[iy],
+                                          self.simulator.max_block_elements)
+        self.Ex[iy, ix] = Ex
+        self.Ey[iy, ix] = Ey
+        self.potential[iy, ix] = potential
+    
+    def build(self):
+        """Построить дерево, уровень за уровнем"""
+        size = 2 ** (self.max_depth - self.base_depth)
+        starts = np.arange(0, 2 ** self.max_depth, size)
+        ix, iy = [a.ravel() for a in np.meshgrid(starts, starts)]
+        
+        charges = np.asarray(self.simulator.charges, dtype=float).reshape(-1, 3)
+        tree = KDTree(charges[:, :2]) if len(charges) else None
+        step_x = self.x[1] - self.x[0]
+        step_y = self.y[1] - self.y[0]
+        E_floor = potential_floor = None
+        
+        while len(ix):
+            half = size // 2
+            corners_x = np.stack([ix, ix + size, ix, ix + size])
+            corners_y = np.stack([iy, iy, iy + size, iy + size])
+            self._evaluate(corners_x.ravel(), corners_y.ravel())
             
-            dx = x - x0
-            dy = y - y0
-            r = np.sqrt(dx**2 + dy**2)
+            if half == 0:
+                # Самый мелкий уровень - дальше не делим
+                self.leaves.extend(zip(ix, iy, np.full(len(ix), size)))
+                break
             
-            if r < 0.1:
-                r = 0.1
-                
-            E_magnitude = k * abs(q) / r**2
-            E_dir_x = dx / r
-            E_dir_y = dy / r
+            self._evaluate(ix + half, iy + half)
             
-            sign = 1 if q > 0 else -1
-            Ex_point += sign * E_magnitude * E_dir_x
-            Ey_point += sign * E_magnitude * E_dir_y
+            # Ошибка билинейной интерполяции в центре ячейки
+            Ex_c = self.Ex[iy + half, ix + half]
+            Ey_c = self.Ey[iy + half, ix + half]
+            potential_c = self.potential[iy + half, ix + half]
+            Ex_err = Ex_c - self.Ex[corners_y, corners_x].mean(axis=0)
+            Ey_err = Ey_c - self.Ey[corners_y, corners_x].mean(axis=0)
+            potential_err = potential_c - self.potential[corners_y, corners_x].mean(axis=0)
+            
+            # Нижняя граница масштаба, чтобы не дробить области почти нулевого поля
+            if E_floor is None:
+                E_floor = 1e-3 * np.max(np.hypot(Ex_c, Ey_c)) + 1e-300
+                potential_floor = 1e-3 * np.max(np.abs(potential_c)) + 1e-300
+            
+            E_scale = np.hypot(Ex_c, Ey_c) + E_floor
+            potential_scale = np.abs(potential_c) + potential_floor
+            steep = ((np.hypot(Ex_err, Ey_err) / E_scale > self.tol) |
+                     (np.abs(potential_err) / potential_scale > self.tol))
+            
+            # Ячейки, рядом с которыми находится заряд
+            if tree is not None:
+                centers = np.column_stack([self.x[ix + half], self.y[iy + half]])
+                distance, _ = tree.query(centers)
+                diagonal = np.hypot(size * step_x, size * step_y)
+                near = distance < self.near_factor * diagonal
+            else:
+                near = np.zeros(len(ix), dtype=bool)
+            
+            refine = steep | near
+            self.leaves.extend(zip(ix[~refine], iy[~refine], np.full(np.count_nonzero(~refine), size)))
             
-        return Ex_point, Ey_point
+            # Четыре дочерние ячейки
+            ix, iy = ix[refine], iy[refine]
+            ix = np.concatenate([ix, ix + half, ix, ix + half])
+            iy = np.concatenate([iy, iy, iy + half, iy + half])
+            size = half
+    
+    def resample(self, step=1):
+        """Равномерные массивы x, y, Ex, Ey, potential для streamplot/contour.
+        
+        Внутри каждого листа значения интерполируются билинейно по его углам.
+        step - прореживание мелкой решетки (1 - максимальное разрешение).
+        """
+        Ex = np.empty_like(self.Ex)
+        Ey = np.empty_like(self.Ey)
+        potential = np.empty_like(self.potential)
+        leaves = np.array(self.leaves, dtype=int).reshape(-1, 3)
+        
+        # Листья одного размера обрабатываются вместе
+        for size in np.unique(leaves[:, 2]):
+            ix, iy = leaves[leaves[:, 2] == size, :2].T
+            offsets = np.arange(size + 1)
+            t = offsets / size
+            
+            # Индексы узлов внутри листьев: (листья, size+1, size+1)
+            rows = iy[:, None, None] + offsets[None, :, None]
+            cols = ix[:, None, None] + offsets[None, None, :]
+            ty = t[None, :, None]
+            tx = t[None, None, :]
+            
+            for source, target in ((self.Ex, Ex), (self.Ey, Ey), (self.potential, potential)):
+                v00 = source[iy, ix][:, None, None]
+                v10 = source[iy, ix + size][:, None, None]
+                v01 = source[iy + size, ix][:, None, None]
+                v11 = source[iy + size, ix + size][:, None, None]
+                target[rows, cols] = ((1 - ty) * ((1 - tx) * v00 + tx * v10) +
+                                      ty * ((1 - tx) * v01 + tx * v11))
+        
+        return (self.x[::step], self.y[::step], Ex[::step, ::step],
+                Ey[::step, ::step], potential[::step, ::step])
+
+class TestChargeCloud:
+    """Облако пробных зарядов, которые двигаются в поле одновременно"""
+    def __init__(self, positions, q=-0.1, record=False):
+        self.pos = np.array(positions, dtype=float).reshape(-1, 2)
+        self.q = np.asarray(q, dtype=float)  # Общий заряд или по заряду на частицу
+        # История позиций копится только по запросу: анимация хранит
+        # траекторию в своем буфере и бесконечный список ей не нужен
+        self.record = record
+        self.trajectory = []
+        
+    def step(self, simulator, dt):
+        """Один шаг интегрирования для всех частиц облака"""
+        Ex, Ey = simulator.get_field_at_points(self.pos[:, 0], self.pos[:, 1])
+        
+        # Обновление позиций (упрощенная физика: смещение пропорционально силе)
+        self.pos[:, 0] += self.q * Ex * dt
+        self.pos[:, 1] += self.q * Ey * dt
+        
+        if self.record:
+            self.trajectory.append(self.pos.copy())
+        
+    def trajectory_array(self):
+        """Траектории в виде массива (шаги, частицы, 2); требует record=True"""
+        return np.array(self.trajectory).reshape(-1, len(self.pos), 2)
 
 class FieldVisualizer:
     def __init__(self, simulator):
@@ -104,10 +516,13 @@ class FieldVisualizer:
         self.fig, self.ax = plt.subplots(figsize=(10, 8))
         plt.subplots_adjust(bottom=0.2)
         
-        self.quiver = None
-        self.contour = None
         self.charge_artists = []
         
+        # Кэш слоев визуализации: режим -> список artist'ов.
+        # Действителен, пока не изменилась версия состояния симулятора
+        self.layers = {}
+        self.layers_version = None
+        
         # Создаем слайдеры для добавления зарядов
         axcolor = 'lightgoldenrodyellow'
         ax_x = plt.axes([0.25, 0.15, 0.65, 0.03], facecolor=axcolor)
@@ -173,49 +588,121 @@ class FieldVisualizer:
         
     def update_plot(self):
         """Обновить график"""
-        self.ax.clear()
-        
-        if self.visualization_mode == 'field_lines':
-            # Визуализация силовых линий
-            stream = self.ax.streamplot(self.simulator.X, self.simulator.Y, 
-                                      self.simulator.Ex, self.simulator.Ey,
-                                      linewidth=1, color='blue',
-                                      density=2, arrowstyle='->', arrowsize=1.5)
-            
-        else:
-            # Визуализация эквипотенциальных линий
-            contour = self.ax.contour(self.simulator.X, self.simulator.Y, 
-                                    self.simulator.potential, 20, cmap='RdYlBu')
-            self.ax.clabel(contour, inline=True, fontsize=8)
-            
-            # Также показываем поле стрелками
-            self.ax.quiver(self.simulator.X[::3, ::3], self.simulator.Y[::3, ::3],
-                         self.simulator.Ex[::3, ::3], self.simulator.Ey[::3, ::3],
-                         scale=30, color='black', alpha=0.7)
-        
-        # Отображаем заряды
-        for i, (x, y, q) in enumerate(self.simulator.charges):
-            color = 'red' if q > 0 else 'blue'
-            circle = Circle((x, y), 0.1, color=color, alpha=0.7)
-            self.ax.add_patch(circle)
-            
-            # Подписываем заряды
-            sign = '+' if q > 0 else '-'
-            self.ax.text(x, y + 0.15, f'{sign}{abs(q):.1f}', 
-                        ha='center', va='center', fontweight='bold')
-        
-        self.ax.set_xlim(self.simulator.x_range)
-        self.ax.set_ylim(self.simulator.y_range)
-        self.ax.set_xlabel('X')
-        self.ax.set_ylabel('Y')
-        
-        title_mode = 'Силовые линии' if self.visualization_mode == 'field_lines' else 'Эквипотенциальные линии'
-        self.ax.set_title(f'Симулятор электрического поля - {title_mode}')
-        self.ax.grid(True, alpha=0.3)
-        self.ax.set_aspect('equal')
-        
+        if self.layers_version != self.simulator.version:
+            # Заряды изменились: кэшированные слои устарели
+            for artist in self.charge_artists + [a for layer in self.layers.values() for a in layer]:
+                # Подписи изолиний удаляются вместе со своим ContourSet
+                if artist.axes is not None:
+                    artist.remove()
+            self.layers = {}
+            self.charge_artists = collect_new_artists(self.ax, draw_charges, self.simulator)
+            self.layers_version = self.simulator.version
+        
+        # Слой текущего режима строится один раз на версию,
+        # переключение режимов только меняет видимость
+        if self.visualization_mode not in self.layers:
+            draw = draw_field_lines if self.visualization_mode == 'field_lines' else draw_equipotentials
+            self.layers[self.visualization_mode] = collect_new_artists(self.ax, draw, self.simulator)
+        
+        for mode, layer in self.layers.items():
+            for artist in layer:
+                artist.set_visible(mode == self.visualization_mode)
+        
+        format_field_axes(self.ax, self.simulator, self.visualization_mode)
         plt.draw()
 
+def collect_new_artists(ax, draw, *args):
+    """Вызвать функцию рисования и вернуть добавленные ею на оси artist'ы"""
+    before = set(ax.get_children())
+    draw(ax, *args)
+    return [artist for artist in ax.get_children() if artist not in before]
+
+def draw_field_lines(ax, simulator):
+    """Визуализация силовых линий"""
+    return ax.streamplot(simulator.x, simulator.y, simulator.Ex, simulator.Ey,
+                         linewidth=1, color='blue',
+                         density=2, arrowstyle='->', arrowsize=1.5)
+
+def draw_equipotentials(ax, simulator):
+    """Визуализация эквипотенциальных линий"""
+    contour = ax.contour(simulator.x, simulator.y, simulator.potential, 20, cmap='RdYlBu')
+    ax.clabel(contour, inline=True, fontsize=8)
+    
+    # Также показываем поле стрелками
+    ax.quiver(simulator.x[::3], simulator.y[::3],
+              simulator.Ex[::3, ::3], simulator.Ey[::3, ::3],
+              scale=30, color='black', alpha=0.7)
+    return contour
+
+def draw_charges(ax, simulator):
+    """Отображение зарядов с подписями"""
+    for x, y, q in simulator.charges:
+        color = 'red' if q > 0 else 'blue'
+        circle = Circle((x, y), 0.1, color=color, alpha=0.7)
+        ax.add_patch(circle)
+        
+        # Подписываем заряды
+        sign = '+' if q > 0 else '-'
+        ax.text(x, y + 0.15, f'{sign}{abs(q):.1f}',
+                ha='center', va='center', fontweight='bold')
+
+def format_field_axes(ax, simulator, mode):
+    """Пределы, подписи и заголовок осей для режима визуализации"""
+    ax.set_xlim(simulator.x_range)
+    ax.set_ylim(simulator.y_range)
+    ax.set_xlabel('X')
+    ax.set_ylabel('Y')
+    
+    title_mode = 'Силовые линии' if mode == 'field_lines' else 'Эквипотенциальные линии'
+    ax.set_title(f'Симулятор электрического поля - {title_mode}')
+    ax.grid(True, alpha=0.3)
+    ax.set_aspect('equal')
+
+def draw_field(ax, simulator, mode):
+    """Полностью перерисовать поле на осях ('field_lines' или 'potential')"""
+    ax.clear()
+    
+    if mode == 'field_lines':
+        draw_field_lines(ax, simulator)
+    else:
+        draw_equipotentials(ax, simulator)
+    
+    draw_charges(ax, simulator)
+    format_field_axes(ax, simulator, mode)
+
+def render_scene(charges, path, mode='field_lines', grid_size=100, dpi=100):
+    """Нарисовать конфигурацию зарядов в файл без окна (холст Agg)"""
+    simulator = ElectricFieldSimulator(grid_size=grid_size)
+    simulator.charges = [tuple(charge) for charge in charges]
+    simulator.calculate_field()
+    
+    # Figure без pyplot: окно не создается при любом бэкенде
+    fig = Figure(figsize=(10, 8))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    draw_field(ax, simulator, mode)
+    fig.savefig(path, dpi=dpi)
+    return path
+
+def render_scenes_batch(scenes, output_dir, modes=('field_lines', 'potential'),
+                        grid_size=100, dpi=100, processes=None):
+    """Отрисовать список конфигураций зарядов в файлы на пуле процессов.
+    
+    scenes - список конфигураций, каждая - список зарядов (x, y, q).
+    Для каждой сцены и каждого режима сохраняется PNG в output_dir.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    
+    jobs = [(charges, os.path.join(output_dir, f'scene_{i:04d}_{mode}.png'), mode)
+            for i, charges in enumerate(scenes) for mode in modes]
+    if not jobs:
+        return []
+    charges, paths, job_modes = zip(*jobs)
+    
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        return list(pool.map(render_scene, charges, paths, job_modes,
+                             [grid_size] * len(jobs), [dpi] * len(jobs)))
+
 def test_simulator():
     """Тестовая функция для демонстрации работы симулятора"""
     simulator = ElectricFieldSimulator()
@@ -231,66 +718,197 @@ def test_simulator():
     
     return simulator, visualizer
 
+def benchmark_field_solver(n_charges=300, grid_size=500, seed=0):
+    """Сравнение векторизованного расчета поля с исходным циклом по зарядам"""
+    simulator = ElectricFieldSimulator(grid_size=grid_size, seed=seed)
+    simulator.charges = simulator.random_charges(n_charges)
+    
+    start = time.perf_counter()
+    simulator.calculate_field_loop()
+    loop_time = time.perf_counter() - start
+    Ex_ref, Ey_ref, potential_ref = simulator.Ex, simulator.Ey, simulator.potential
+    
+    start = time.perf_counter()
+    simulator.calculate_field()
+    vector_time = time.perf_counter() - start
+    
+    def relative_error(a, b):
+        return np.max(np.abs(a - b)) / max(np.max(np.abs(b)), 1e-300)
+    
+    error = max(relative_error(simulator.Ex, Ex_ref),
+                relative_error(simulator.Ey, Ey_ref),
+                relative_error(simulator.potential, potential_ref))
+    
+    print(f"Зарядов: {n_charges}, сетка: {grid_size}x{grid_size}")
+    print(f"Цикл по зарядам:    {loop_time:.3f} с")
+    print(f"Векторизованный:    {vector_time:.3f} с (ускорение x{loop_time / vector_time:.1f})")
+    print(f"Макс. относительная ошибка: {error:.2e}")
+    return loop_time, vector_time, error
+
+def barnes_hut_error_report(n_charges=5000, grid_size=200, thetas=(0.3, 0.5, 0.8), seed=0):
+    """Точность и скорость Barnes-Hut в сравнении с точной прямой суммой"""
+    simulator = ElectricFieldSimulator(grid_size=grid_size, seed=seed)
+    simulator.charges = simulator.random_charges(n_charges)
+    
+    start = time.perf_counter()
+    simulator.calculate_field()
+    direct_time = time.perf_counter() - start
+    E_ref = np.hypot(simulator.Ex, simulator.Ey)
+    Ex_ref, Ey_ref, potential_ref = simulator.Ex, simulator.Ey, simulator.potential
+    
+    print(f"Зарядов: {n_charges}, сетка: {grid_size}x{grid_size}")
+    print(f"Прямая сумма: {direct_time:.3f} с")
+    
+    simulator.field_method = 'barnes_hut'
+    report = []
+    for theta in thetas:
+        simulator.theta = theta
+        start = time.perf_counter()
+        simulator.calculate_field()
+        tree_time = time.perf_counter() - start
+        
+        # Относительная ошибка в точке велика там, где поля зарядов почти
+        # компенсируются, поэтому дополнительно считаем ошибку к RMS поля
+        E_diff = np.hypot(simulator.Ex - Ex_ref, simulator.Ey - Ey_ref)
+        E_error = E_diff / E_ref
+        E_error_rms = np.max(E_diff) / np.sqrt(np.mean(E_ref ** 2))
+        potential_error = (np.max(np.abs(simulator.potential - potential_ref)) /
+                           np.max(np.abs(potential_ref)))
+        report.append({'theta': theta, 'time': tree_time,
+                       'E_error_median': np.median(E_error),
+                       'E_error_p99': np.percentile(E_error, 99),
+                       'E_error_max_rms': E_error_rms,
+                       'potential_error_max': potential_error})
+        print(f"theta={theta:.2f}: {tree_time:.3f} с (x{direct_time / tree_time:.1f}), "
+              f"ошибка E: медиана {np.median(E_error):.2e}, 99% {np.percentile(E_error, 99):.2e}, "
+              f"макс/RMS {E_error_rms:.2e}, ошибка потенциала {potential_error:.2e}")
+    return report
+
+def compare_adaptive_grid(max_depth=8, tol=0.01):
+    """Сравнение адаптивной сетки с равномерной сеткой того же разрешения"""
+    charges = [(-2, 1, 1.0), (1.3, -2.2, -1.5), (2.5, 2.5, 0.7), (0, 0, -0.3)]
+    
+    uniform = ElectricFieldSimulator(grid_size=2 ** max_depth + 1)
+    uniform.charges = list(charges)
+    start = time.perf_counter()
+    uniform.calculate_field()
+    uniform_time = time.perf_counter() - start
+    
+    adaptive = ElectricFieldSimulator()
+    adaptive.charges = list(charges)
+    start = time.perf_counter()
+    grid = adaptive.calculate_field_adaptive(max_depth=max_depth, tol=tol)
+    adaptive_time = time.perf_counter() - start
+    
+    E_ref = np.hypot(uniform.Ex, uniform.Ey)
+    E = np.hypot(adaptive.Ex, adaptive.Ey)
+    E_error = np.abs(E - E_ref) / E_ref
+    potential_error = (np.max(np.abs(adaptive.potential - uniform.potential)) /
+                       np.max(np.abs(uniform.potential)))
+    
+    print(f"Равномерная сетка: {uniform.Ex.size} точек, {uniform_time:.3f} с")
+    print(f"Адаптивная сетка:  {grid.evaluated_points} точек, {len(grid.leaves)} листьев, "
+          f"{adaptive_time:.3f} с")
+    print(f"Ошибка |E|: медиана {np.median(E_error):.2e}, 99% {np.percentile(E_error, 99):.2e}")
+    print(f"Макс. относительная ошибка потенциала: {potential_error:.2e}")
+    return grid
+
+def compare_grid_memory(grid_size=2000, n_charges=20, seed=0):
+    """Память и время расчета для float64 с meshgrid и float32 без meshgrid"""
+    charges = ElectricFieldSimulator(grid_size=2, seed=seed).random_charges(n_charges)
+    results = {}
+    for dtype, materialize_grid in ((np.float64, True), (np.float32, False)):
+        simulator = ElectricFieldSimulator(grid_size=grid_size, dtype=dtype,
+                                           materialize_grid=materialize_grid)
+        simulator.charges = list(charges)
+        start = time.perf_counter()
+        simulator.calculate_field()
+        elapsed = time.perf_counter() - start
+        
+        name = f"{np.dtype(dtype).name}, meshgrid={'да' if materialize_grid else 'нет'}"
+        results[name] = (simulator.memory_usage(), elapsed, simulator)
+        print(f"{name}: {simulator.memory_usage() / 2**20:.1f} МБ, {elapsed:.3f} с")
+    
+    (_, _, reference), (_, _, compact) = results.values()
+    error = np.max(np.abs(compact.potential - reference.potential)) / np.max(np.abs(reference.potential))
+    print(f"Макс. относительная ошибка float32: {error:.2e}")
+    return results
+
 # Дополнительная функция для анимации движения заряда
-def animate_test_charge():
-    """Анимация движения пробного заряда в поле"""
+def animate_test_charge(n_particles=1):
+    """Анимация движения пробных зарядов в поле"""
     simulator = ElectricFieldSimulator()
     simulator.add_charge(0, 0, 2.0)  # Центральный положительный заряд
     
     fig, ax = plt.subplots(figsize=(8, 8))
     
-    # Инициализация пробного заряда
-    test_charge = {'pos': np.array([3.0, 0.0]), 'q': -0.1, 'trajectory': []}
+    # Инициализация пробных зарядов на окружности радиуса 3 (первый - в точке (3, 0))
+    angles = np.linspace(0, 2 * np.pi, n_particles, endpoint=False)
+    cloud = TestChargeCloud(np.column_stack([3.0 * np.cos(angles), 3.0 * np.sin(angles)]), q=-0.1)
     dt = 0.01
     
+    # Заряды неподвижны: поле и силовые линии рассчитываются один раз
+    # и остаются статическим фоном анимации
+    ax.streamplot(simulator.x, simulator.y, simulator.Ex, simulator.Ey,
+                  linewidth=1, color='blue', density=2)
+    
+    # Отображаем заряды
+    for x, y, q in simulator.charges:
+        color = 'red' if q > 0 else 'blue'
+        circle = Circle((x, y), 0.1, color=color, alpha=0.7)
+        ax.add_patch(circle)
+    
+    ax.set_xlim(-5, 5)
+    ax.set_ylim(-5, 5)
+    ax.set_xlabel('X')
+    ax.set_ylabel('Y')
+    ax.set_title('Движение пробного заряда в электрическом поле')
+    ax.set_aspect('equal')
+    ax.grid(True, alpha=0.3)
+    
+    # Обновляются только траектории и пробные заряды (через blitting)
+    trajectory_line, = ax.plot([], [], 'g-', linewidth=2, animated=True)
+    marker, = ax.plot([], [], 'go', markersize=8, animated=True)
+    
+    # Предвыделенный буфер траекторий: строка на частицу, лишний NaN-столбец
+    # разделяет частицы, так что все траектории рисуются одной линией
+    frames = 200
+    trajectory_x = np.full((n_particles, frames + 1), np.nan)
+    trajectory_y = np.full((n_particles, frames + 1), np.nan)
+    
+    def init():
+        return trajectory_line, marker
+    
     def animate(frame):
-        ax.clear()
-        
-        # Рассчитываем поле
-        simulator.calculate_field()
-        
-        # Визуализация поля
-        stream = ax.streamplot(simulator.X, simulator.Y, simulator.Ex, simulator.Ey,
-                             linewidth=1, color='blue', density=2)
-        
-        # Отображаем заряды
-        for x, y, q in simulator.charges:
-            color = 'red' if q > 0 else 'blue'
-            circle = Circle((x, y), 0.1, color=color, alpha=0.7)
-            ax.add_patch(circle)
+        # Расчет силы и движение всех пробных зарядов
+        cloud.step(simulator, dt)
         
-        # Расчет силы и движение пробного заряда
-        Ex, Ey = simulator.get_field_at_point(test_charge['pos'][0], test_charge['pos'][1])
-        Fx = test_charge['q'] * Ex
-        Fy = test_charge['q'] * Ey
+        # При повторе анимации буфер траекторий заполняется заново
+        if frame == 0:
+            trajectory_x.fill(np.nan)
+            trajectory_y.fill(np.nan)
+        trajectory_x[:, frame] = cloud.pos[:, 0]
+        trajectory_y[:, frame] = cloud.pos[:, 1]
+        trajectory_line.set_data(trajectory_x.ravel(), trajectory_y.ravel())
         
-        # Обновление позиции (упрощенная физика)
-        test_charge['pos'][0] += Fx * dt
-        test_charge['pos'][1] += Fy * dt
+        marker.set_data(cloud.pos[:, 0], cloud.pos[:, 1])
         
-        test_charge['trajectory'].append(test_charge['pos'].copy())
-        
-        # Рисуем траекторию
-        if len(test_charge['trajectory']) > 1:
-            trajectory = np.array(test_charge['trajectory'])
-            ax.plot(trajectory[:, 0], trajectory[:, 1], 'g-', linewidth=2)
-        
-        # Рисуем пробный заряд
-        ax.plot(test_charge['pos'][0], test_charge['pos'][1], 'go', markersize=8)
-        
-        ax.set_xlim(-5, 5)
-        ax.set_ylim(-5, 5)
-        ax.set_xlabel('X')
-        ax.set_ylabel('Y')
-        ax.set_title('Движение пробного заряда в электрическом поле')
-        ax.set_aspect('equal')
-        ax.grid(True, alpha=0.3)
-        
-        return []
+        return trajectory_line, marker
     
-    anim = animation.FuncAnimation(fig, animate, frames=200, interval=50, blit=False)
+    anim = animation.FuncAnimation(fig, animate, init_func=init, frames=frames,
+                                   interval=50, blit=True)
     plt.show()
 
 if __name__ == "__main__":
     # Запуск основной программы
-    simulator, visualizer = test_simulator()
\ No newline at end of file
+    simulator, visualizer = test_simulator()
+    
+    # Раскомментируйте для сравнения скорости расчета поля:
+    # benchmark_field_solver()
+    # compare_adaptive_grid()
+    # barnes_hut_error_report()
+    # compare_grid_memory()
+    
+    # Раскомментируйте для пакетной отрисовки (диполь с разным расстоянием):
+    # render_scenes_batch([[(-d, 0, 1.0), (d, 0, -1.0)] for d in np.linspace(0.5, 3, 12)],
+    #                     'field_renders')
\ No newline at end of file
@@ -1,3 +1,11 @@
+import os
+import json
+import time
+import itertools
+import contextlib
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.animation import FuncAnimation
@@ -5,15 +13,250 @@ from matplotlib.widgets import Slider, Button
 from scipy.spatial import KDTree
 import matplotlib.colors as mcolors
 
+def minimum_image(d, L):
+    """Кратчайшее смещение с учетом периодических границ (тор со стороной L)"""
+    return d - L * np.round(d / L)
+
+def wrap_periodic(v, L):
+    """Перенос координат в [0, L) (x % L может дать ровно L из-за округления)"""
+    v = v % L
+    v[v >= L] = 0.0
+    return v
+
+def pair_displacements(x, y, i, j, L):
+    """Смещения от i к j по кратчайшему пути на торе и расстояния"""
+    dx = minimum_image(x[j] - x[i], L)
+    dy = minimum_image(y[j] - y[i], L)
+    return dx, dy, np.sqrt(dx**2 + dy**2)
+
+def canonical_pairs(x, y, i, j, L):
+    """Пары в едином порядке: i < j, сортировка по (i, j), затем смещения.
+    
+    Способы поиска соседей находят одни и те же пары в разном порядке, а
+    суммы bincount зависят от порядка слагаемых. Единый порядок делает
+    шаг модели одинаковым при любом способе поиска.
+    """
+    i, j = np.minimum(i, j), np.maximum(i, j)
+    order = np.argsort(i * len(x) + j)
+    i, j = i[order], j[order]
+    return (i, j) + pair_displacements(x, y, i, j, L)
+
+class KDTreeNeighbors:
+    """Поиск соседей через периодическое KD-дерево (scipy)"""
+    name = 'kdtree'
+    
+    @staticmethod
+    def supports(L, R):
+        return True
+    
+    def build(self, x, y, L, R, groups=None):
+        """Построение дерева по текущим позициям.
+        
+        groups - номер независимой реплики для каждой частицы (или None).
+        Реплики разносятся по третьей координате с шагом 2R, поэтому
+        пары между разными репликами не находятся.
+        """
+        self.x, self.y, self.L, self.R = x, y, L, R
+        if groups is None:
+            self.tree = KDTree(np.column_stack([x, y]), boxsize=L)
+        else:
+            spacing = 2 * R
+            n_groups = int(groups.max()) + 1
+            self.tree = KDTree(np.column_stack([x, y, groups * spacing]),
+                               boxsize=[L, L, n_groups * spacing])
+    
+    def query(self):
+        """Все пары соседей (i, j) в радиусе R, смещения и расстояния"""
+        i, j = self.tree.query_pairs(self.R, output_type='ndarray').T
+        return canonical_pairs(self.x, self.y, i, j, self.L)
+
+class CellListNeighbors:
+    """Поиск соседей через список ячеек (пространственный хэш).
+    
+    Частицы раскладываются по ячейкам со стороной >= R за O(N): номер ячейки
+    floor(x / cell). Соседи ищутся только в своей и соседних ячейках, каждая
+    пара ячеек просматривается один раз (половина шаблона 3x3).
+    """
+    name = 'cells'
+    half_stencil = ((1, -1), (1, 0), (1, 1), (0, 1))
+    
+    @staticmethod
+    def supports(L, R):
+        # При меньшем числе ячеек соседние ячейки совпадают через границу
+        return L // R >= 3
+    
+    def build(self, x, y, L, R, groups=None):
+        """Раскладка частиц по ячейкам (у каждой реплики groups свои ячейки)"""
+        if not self.supports(L, R):
+            raise ValueError(f"Список ячеек требует L // R >= 3 (L={L}, R={R}); используйте 'kdtree'")
+        self.x, self.y, self.L, self.R = x, y, L, R
+        n = int(L // R)
+        cell_size = L / n
+        self.n_cells = n
+        
+        self.cx = np.minimum((x / cell_size).astype(np.intp), n - 1)
+        self.cy = np.minimum((y / cell_size).astype(np.intp), n - 1)
+        self.group_offset = 0 if groups is None else groups * (n * n)
+        n_groups = 1 if groups is None else int(groups.max()) + 1
+        cell = self.group_offset + self.cx * n + self.cy
+        
+        # Частицы, отсортированные по ячейкам; ячейка k занимает [start[k], end[k])
+        self.order = np.argsort(cell, kind='stable')
+        sorted_cells = cell[self.order]
+        all_cells = np.arange(n_groups * n * n)
+        self.start = np.searchsorted(sorted_cells, all_cells, side='left')
+        self.end = np.searchsorted(sorted_cells, all_cells, side='right')
+        self.cell = cell
+        self.rank = np.empty(len(x), dtype=np.intp)
+        self.rank[self.order] = np.arange(len(x))
+    
+    def _expand(self, lo, hi):
+        """Пары (p, order[k]) для всех частиц p и k из диапазона [lo[p], hi[p])"""
+        counts = np.maximum(hi - lo, 0)
+        i = np.repeat(np.arange(len(counts)), counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        return i, self.order[np.repeat(lo, counts) + offsets]
+    
+    def query(self):
+        """Все пары соседей (i, j) в радиусе R, смещения и расстояния"""
+        n = self.n_cells
+        
+        # Своя ячейка: только частицы, стоящие позже в отсортированном порядке
+        pairs = [self._expand(self.rank + 1, self.end[self.cell])]
+        
+        for ox, oy in self.half_stencil:
+            neighbor_cell = self.group_offset + ((self.cx + ox) % n) * n + (self.cy + oy) % n
+            pairs.append(self._expand(self.start[neighbor_cell], self.end[neighbor_cell]))
+        
+        i = np.concatenate([p[0] for p in pairs])
+        j = np.concatenate([p[1] for p in pairs])
+        dx, dy, dist = pair_displacements(self.x, self.y, i, j, self.L)
+        
+        close = dist <= self.R
+        return canonical_pairs(self.x, self.y, i[close], j[close], self.L)
+
+NEIGHBOR_BACKENDS = {backend.name: backend for backend in (KDTreeNeighbors, CellListNeighbors)}
+
+class StepProfiler:
+    """Время фаз шага update_swarm за последние window шагов.
+    
+    Фазы: построение структуры соседей, запрос пар, накопление сил
+    (выравнивание, когезия, разделение) и интегрирование.
+    """
+    phases = {'build': 'построение', 'query': 'соседи', 'forces': 'силы', 'integrate': 'интегр.'}
+    
+    def __init__(self, window=200):
+        self.samples = {phase: deque(maxlen=window) for phase in self.phases}
+    
+    def record(self, phase, seconds):
+        self.samples[phase].append(seconds)
+    
+    def stats(self):
+        """p50 и p95 времени каждой фазы в миллисекундах"""
+        result = {}
+        for phase, samples in self.samples.items():
+            if samples:
+                p50, p95 = np.percentile(list(samples), [50, 95]) * 1e3
+                result[phase] = (p50, p95)
+        return result
+    
+    def report(self):
+        """Текстовая сводка: по строке на фазу"""
+        return '\n'.join(f'{self.phases[phase]}: p50 {p50:.2f} / p95 {p95:.2f} мс'
+                         for phase, (p50, p95) in self.stats().items())
+
+class SwarmRecorder:
+    """Запись траекторий (x, y, theta) каждого шага в файл .npy.
+    
+    Файл создается сразу на max_steps шагов через np.lib.format.open_memmap
+    и заполняется по мере симуляции, поэтому длинная запись не держится в памяти.
+    Число записанных шагов и параметры модели сохраняются рядом в <path>.json
+    сразу при создании и обновляются каждые flush_every шагов, так что
+    прерванную запись можно открыть (без последних несохраненных шагов).
+    """
+    def __init__(self, path, shape, max_steps, L, dt, dtype=np.float32, flush_every=100):
+        self.path = path
+        self.L = L
+        self.dt = dt
+        self.flush_every = flush_every
+        self.data = np.lib.format.open_memmap(path, mode='w+', dtype=dtype,
+                                              shape=(max_steps, 3) + tuple(shape))
+        self.steps = 0
+        self.write_meta()
+    
+    def write_meta(self):
+        """Запись метаданных через временный файл, чтобы сбой не оставил обрывок JSON"""
+        tmp_path = self.path + '.json.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'steps': self.steps, 'L': self.L, 'dt': self.dt}, f)
+        os.replace(tmp_path, self.path + '.json')
+    
+    def flush(self):
+        """Сброс записанных шагов на диск и обновление их числа в метаданных"""
+        self.data.flush()
+        self.write_meta()
+    
+    @property
+    def full(self):
+        return self.steps >= len(self.data)
+    
+    def record(self, x, y, theta):
+        """Запись одного шага"""
+        frame = self.data[self.steps]
+        frame[0] = x
+        frame[1] = y
+        frame[2] = theta
+        self.steps += 1
+        if self.steps % self.flush_every == 0:
+            self.flush()
+    
+    def close(self):
+        """Сброс данных на диск и запись метаданных"""
+        self.flush()
+        self.data = None
+
+def load_recording(path):
+    """Открытие записи SwarmRecorder только для чтения.
+    
+    Возвращает memmap формы (steps, 3, ...) - кадры читаются с диска по
+    требованию - и словарь метаданных.
+    """
+    with open(path + '.json') as f:
+        meta = json.load(f)
+    frames = np.load(path, mmap_mode='r')[:meta['steps']]
+    return frames, meta
+
 class AdvancedSwarmModel:
-    def __init__(self, N=200, L=20, v0=2.0, R=1.5, eta=0.3, dt=0.1):
+    def __init__(self, N=200, L=20, v0=2.0, R=1.5, eta=0.3, dt=0.1, neighbor_backend='auto',
+                 replicas=None, seed=None):
         self.N = N
+        
+        # Ансамбль: replicas независимых роев в массивах формы (replicas, N),
+        # которые обновляются одним векторизованным шагом
+        self.replicas = replicas
+        self.shape = (N,) if replicas is None else (replicas, N)
+        self.groups = None if replicas is None else np.repeat(np.arange(replicas), N)
         self.L = L
         self.v0 = v0
         self.R = R
         self.eta = eta
         self.dt = dt
         
+        # Поиск соседей: 'kdtree', 'cells' или 'auto' (самый быстрый для N и плотности)
+        self.neighbor_backend = neighbor_backend
+        self.backends = {name: backend() for name, backend in NEIGHBOR_BACKENDS.items()}
+        self.backend_choice = {}  # Кэш выбора для 'auto': (число частиц, плотность) -> имя
+        
+        # Собственный генератор случайных чисел (seed - число или SeedSequence).
+        # У каждой реплики ансамбля свой дочерний поток, поэтому реплика b
+        # воспроизводит одиночную модель с seed=spawn(replicas)[b]
+        self.seed_sequence = (seed if isinstance(seed, np.random.SeedSequence)
+                              else np.random.SeedSequence(seed))
+        self.rng = np.random.default_rng(self.seed_sequence)
+        if replicas is not None:
+            self.replica_rngs = [np.random.default_rng(child)
+                                 for child in self.seed_sequence.spawn(replicas)]
+        
         # Инициализация частиц
         self.reset_particles()
         
@@ -23,121 +266,283 @@ class AdvancedSwarmModel:
         self.separation_strength = 0.5
         self.separation_distance = 0.8
         
+        # Запись траекторий (см. start_recording)
+        self.recorder = None
+        
+        # Скользящая статистика времени фаз шага
+        self.profiler = StepProfiler()
+        
     def reset_particles(self):
         """Сброс частиц в случайное состояние"""
-        self.x = np.random.rand(self.N) * self.L
-        self.y = np.random.rand(self.N) * self.L
-        self.theta = 2 * np.pi * np.random.rand(self.N)
-        self.velocity = np.ones(self.N) * self.v0
+        self.x = self.random() * self.L
+        self.y = self.random() * self.L
+        self.theta = 2 * np.pi * self.random()
+        self.velocity = np.ones(self.shape) * self.v0
         
         # Дополнительные параметры для визуализации
-        self.energy = np.zeros(self.N)
-        self.neighbor_count = np.zeros(self.N)
+        self.energy = np.zeros(self.shape)
+        self.neighbor_count = np.zeros(self.shape)
         
+    def start_recording(self, path, max_steps):
+        """Начало записи x, y, theta каждого шага в файл path (не более max_steps шагов)"""
+        self.stop_recording()
+        self.recorder = SwarmRecorder(path, self.shape, max_steps, self.L, self.dt)
+        return self.recorder
+    
+    def stop_recording(self):
+        """Завершение записи"""
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+    
+    def random(self):
+        """Равномерные случайные числа [0, 1) формы self.shape из потоков модели"""
+        if self.replicas is None:
+            return self.rng.random(self.N)
+        return np.stack([rng.random(self.N) for rng in self.replica_rngs])
+    
+    def spawn(self, n):
+        """Независимые дочерние seed для n параллельных запусков"""
+        return self.seed_sequence.spawn(n)
+    
     def update_swarm(self):
         """Обновление состояния роя с улучшенной физикой"""
-        # Создаем KD-дерево для эффективного поиска соседей
-        points = np.column_stack([self.x, self.y])
-        tree = KDTree(points)
+        # Все пары соседей в радиусе R (через периодические границы),
+        # каждая пара один раз, со смещениями от i к j.
+        # Реплики ансамбля обрабатываются вместе как одна плоская выборка
+        backend = self.select_backend()  # разовый замер для 'auto' не входит в статистику
+        start = time.perf_counter()
+        backend.build(self.x.ravel(), self.y.ravel(), self.L, self.R, self.groups)
+        built = time.perf_counter()
+        i, j, dx, dy, dist = backend.query()
+        queried = time.perf_counter()
         
-        new_theta = np.copy(self.theta)
+        # Каждая пара - соседи друг для друга
+        size = self.x.size
+        self.neighbor_count = (np.bincount(i, minlength=size) +
+                               np.bincount(j, minlength=size)).astype(float).reshape(self.shape)
+        has_neighbors = self.neighbor_count.ravel() > 0
         
-        for i in range(self.N):
-            # Находим всех соседей в радиусе R
-            neighbors = tree.query_ball_point([self.x[i], self.y[i]], self.R)
-            neighbors = [n for n in neighbors if n != i]  # Исключаем саму частицу
-            
-            self.neighbor_count[i] = len(neighbors)
-            
-            if len(neighbors) > 0:
-                # Выравнивание (Alignment)
-                alignment_angle = self.calculate_alignment(i, neighbors)
-                
-                # Когезия (Cohesion) - стремление к центру масс
-                cohesion_angle = self.calculate_cohesion(i, neighbors)
-                
-                # Разделение (Separation) - избегание столкновений
-                separation_angle = self.calculate_separation(i, neighbors)
-                
-                # Комбинируем все взаимодействия
-                combined_angle = (
-                    self.alignment_strength * alignment_angle +
-                    self.cohesion_strength * cohesion_angle +
-                    self.separation_strength * separation_angle
-                )
-                
-                # Нормализуем и добавляем шум
-                if np.linalg.norm(combined_angle) > 0:
-                    new_direction = np.arctan2(combined_angle[1], combined_angle[0])
-                    new_theta[i] = new_direction + self.eta * (np.random.random() - 0.5)
-                
-                # Расчет "энергии" взаимодействия
-                self.energy[i] = len(neighbors) / 10.0
-        
-        self.theta = new_theta
+        # Выравнивание (Alignment)
+        alignment = self.calculate_alignment(i, j)
+        
+        # Когезия (Cohesion) - стремление к центру масс
+        cohesion = self.calculate_cohesion(i, j, dx, dy)
+        
+        # Разделение (Separation) - избегание столкновений
+        separation = self.calculate_separation(i, j, dx, dy, dist)
+        
+        # Комбинируем все взаимодействия
+        combined = (
+            self.alignment_strength * alignment +
+            self.cohesion_strength * cohesion +
+            self.separation_strength * separation
+        )
+        
+        # Нормализуем и добавляем шум
+        turn = has_neighbors & np.any(combined != 0, axis=1)
+        noise = self.eta * (self.random().ravel() - 0.5)
+        new_direction = np.arctan2(combined[:, 1], combined[:, 0])
+        self.theta = np.where(turn, new_direction + noise, self.theta.ravel()).reshape(self.shape)
+        
+        # Расчет "энергии" взаимодействия
+        self.energy = np.where(has_neighbors.reshape(self.shape), self.neighbor_count / 10.0, self.energy)
+        forces = time.perf_counter()
         
         # Обновление позиций
         self.x += self.velocity * np.cos(self.theta) * self.dt
         self.y += self.velocity * np.sin(self.theta) * self.dt
         
         # Периодические граничные условия
-        self.x = self.x % self.L
-        self.y = self.y % self.L
+        self.x = wrap_periodic(self.x, self.L)
+        self.y = wrap_periodic(self.y, self.L)
         
         # Динамическое изменение скорости на основе локальной плотности
         self.velocity = self.v0 * (1 - 0.1 * self.neighbor_count / 10)
         self.velocity = np.clip(self.velocity, 0.5 * self.v0, 2 * self.v0)
-    
-    def calculate_alignment(self, i, neighbors):
-        """Расчет выравнивания с соседями"""
-        if not neighbors:
-            return np.array([0, 0])
         
-        avg_cos = np.mean(np.cos(self.theta[neighbors]))
-        avg_sin = np.mean(np.sin(self.theta[neighbors]))
-        return np.array([avg_cos, avg_sin])
+        finished = time.perf_counter()
+        self.profiler.record('build', built - start)
+        self.profiler.record('query', queried - built)
+        self.profiler.record('forces', forces - queried)
+        self.profiler.record('integrate', finished - forces)
+        
+        if self.recorder is not None:
+            self.recorder.record(self.x, self.y, self.theta)
+            if self.recorder.full:
+                self.stop_recording()
     
-    def calculate_cohesion(self, i, neighbors):
-        """Расчет стремления к центру масс соседей"""
-        if not neighbors:
-            return np.array([0, 0])
+    def select_backend(self):
+        """Выбор способа поиска соседей.
+        
+        Если заданный способ не подходит для текущих L и R (например, радиус
+        увеличили слайдером), используется KD-дерево.
+        """
+        if self.neighbor_backend != 'auto':
+            if NEIGHBOR_BACKENDS[self.neighbor_backend].supports(self.L, self.R):
+                return self.backends[self.neighbor_backend]
+            return self.backends['kdtree']
         
-        center_x = np.mean(self.x[neighbors])
-        center_y = np.mean(self.y[neighbors])
+        candidates = [name for name, backend in NEIGHBOR_BACKENDS.items()
+                      if backend.supports(self.L, self.R)]
+        if len(candidates) == 1:
+            return self.backends[candidates[0]]
         
-        dx = center_x - self.x[i]
-        dy = center_y - self.y[i]
-        dist = np.sqrt(dx**2 + dy**2)
+        # Для новой пары (N, плотность) один раз замеряем все способы
+        # на текущих позициях и запоминаем самый быстрый
+        density = self.N * self.R**2 / self.L**2
+        key = (self.x.size, int(np.round(np.log2(density))))
+        if key not in self.backend_choice:
+            timings = {}
+            for name in candidates:
+                start = time.perf_counter()
+                self.backends[name].build(self.x.ravel(), self.y.ravel(), self.L, self.R, self.groups)
+                self.backends[name].query()
+                timings[name] = time.perf_counter() - start
+            self.backend_choice[key] = min(timings, key=timings.get)
         
-        if dist > 0:
-            return np.array([dx/dist, dy/dist])
-        return np.array([0, 0])
+        # Выбор из кэша мог быть сделан при другом R с той же плотностью
+        choice = self.backend_choice[key]
+        if not NEIGHBOR_BACKENDS[choice].supports(self.L, self.R):
+            choice = 'kdtree'
+        return self.backends[choice]
     
-    def calculate_separation(self, i, neighbors):
-        """Расчет разделения для избегания столкновений"""
-        if not neighbors:
-            return np.array([0, 0])
+    def _pair_sum(self, i, j, values_i, values_j):
+        """Сумма по соседям для каждой частицы.
         
-        separation_force = np.array([0.0, 0.0])
+        values_i - вклад, который получает частица i от пары (i, j),
+        values_j - вклад, который получает частица j.
+        """
+        size = self.x.size
+        return (np.bincount(i, weights=values_i, minlength=size) +
+                np.bincount(j, weights=values_j, minlength=size))
+    
+    def _neighbor_mean(self, total):
+        """Среднее по соседям (0 для частиц без соседей)"""
+        count = self.neighbor_count.ravel()
+        return np.divide(total, count, out=np.zeros(count.size), where=count > 0)
+    
+    def calculate_alignment(self, i, j):
+        """Расчет выравнивания с соседями"""
+        cos_theta = np.cos(self.theta.ravel())
+        sin_theta = np.sin(self.theta.ravel())
+        avg_cos = self._neighbor_mean(self._pair_sum(i, j, cos_theta[j], cos_theta[i]))
+        avg_sin = self._neighbor_mean(self._pair_sum(i, j, sin_theta[j], sin_theta[i]))
+        return np.column_stack([avg_cos, avg_sin])
+    
+    def calculate_cohesion(self, i, j, dx, dy):
+        """Расчет стремления к центру масс соседей"""
+        # Смещение к центру масс = среднее смещение к соседям (в минимальном
+        # образе, поэтому центр группы на стыке границ не "разрывается")
+        center_dx = self._neighbor_mean(self._pair_sum(i, j, dx, -dx))
+        center_dy = self._neighbor_mean(self._pair_sum(i, j, dy, -dy))
+        dist = np.sqrt(center_dx**2 + center_dy**2)
         
-        for neighbor in neighbors:
-            dx = self.x[i] - self.x[neighbor]
-            dy = self.y[i] - self.y[neighbor]
-            dist = np.sqrt(dx**2 + dy**2)
-            
-            if dist < self.separation_distance and dist > 0:
-                # Сила отталкивания обратно пропорциональна расстоянию
-                force = 1.0 / dist
-                separation_force[0] += dx / dist * force
-                separation_force[1] += dy / dist * force
+        safe_dist = np.where(dist > 0, dist, 1.0)
+        return np.column_stack([center_dx / safe_dist, center_dy / safe_dist])
+    
+    def calculate_separation(self, i, j, dx, dy, dist):
+        """Расчет разделения для избегания столкновений"""
+        close = (dist < self.separation_distance) & (dist > 0)
+        i, j, dx, dy, dist = i[close], j[close], dx[close], dy[close], dist[close]
+        
+        # Сила отталкивания обратно пропорциональна расстоянию: d / |d| * 1 / |d|
+        fx = dx / dist**2
+        fy = dy / dist**2
         
-        return separation_force
+        # Частицу i отталкивает от j (против dx), частицу j - от i
+        return np.column_stack([self._pair_sum(i, j, -fx, fx),
+                                self._pair_sum(i, j, -fy, fy)])
 
-    def calculate_order_parameter(self):
-        """Расчет параметра порядка (степени когерентности)"""
-        vx = np.mean(np.cos(self.theta))
-        vy = np.mean(np.sin(self.theta))
+    def calculate_order_parameter(self, theta=None):
+        """Расчет параметра порядка (степени когерентности).
+        
+        Для ансамбля - массив значений по репликам. theta позволяет посчитать
+        параметр порядка по снимку состояния, а не по текущим углам модели.
+        """
+        if theta is None:
+            theta = self.theta
+        vx = np.mean(np.cos(theta), axis=-1)
+        vy = np.mean(np.sin(theta), axis=-1)
         return np.sqrt(vx**2 + vy**2)
+    
+    def ensemble_order_statistics(self):
+        """Среднее и дисперсия параметра порядка по репликам ансамбля"""
+        order = self.calculate_order_parameter()
+        return np.mean(order), np.var(order)
+
+class SwarmSimulationThread(threading.Thread):
+    """Фоновый поток симуляции со своим темпом.
+    
+    За один цикл делает substeps шагов модели и публикует снимок состояния
+    в двойной буфер: запись идет в задний буфер, затем буферы меняются местами
+    под коротким замком. GUI копирует только последний опубликованный снимок,
+    поэтому тяжелый шаг при большом N не блокирует слайдеры.
+    """
+    fields = ('x', 'y', 'theta', 'velocity', 'energy', 'neighbor_count')
+    
+    def __init__(self, model, substeps=1, steps_per_second=None):
+        super().__init__(daemon=True)
+        self.model = model
+        self.substeps = substeps
+        self.min_interval = 0.0 if steps_per_second is None else substeps / steps_per_second
+        
+        # model_lock защищает модель (шаг в потоке против сброса и слайдеров GUI),
+        # swap_lock - только смену переднего буфера и чтение из него
+        self.model_lock = threading.Lock()
+        self.swap_lock = threading.Lock()
+        self.buffers = [{name: np.empty(model.shape) for name in self.fields}
+                        for _ in range(2)]
+        self.front = 0
+        self.steps_done = 0
+        
+        self.running = threading.Event()
+        self.running.set()
+        self.stopped = threading.Event()
+        self.publish()
+    
+    def publish(self):
+        """Копирование состояния модели в задний буфер и смена буферов.
+        
+        Вызывается с захваченным model_lock.
+        """
+        back = self.buffers[1 - self.front]
+        for name in self.fields:
+            np.copyto(back[name], getattr(self.model, name))
+        with self.swap_lock:
+            self.front = 1 - self.front
+    
+    def copy_latest(self, out):
+        """Копирование последнего снимка в словарь массивов out"""
+        with self.swap_lock:
+            front = self.buffers[self.front]
+            for name in self.fields:
+                np.copyto(out[name], front[name])
+        return out
+    
+    def run(self):
+        while not self.stopped.is_set():
+            if not self.running.wait(timeout=0.1):
+                continue
+            start = time.perf_counter()
+            with self.model_lock:
+                for _ in range(self.substeps):
+                    self.model.update_swarm()
+                self.publish()
+            self.steps_done += self.substeps
+            
+            # Короткая уступка GIL потоку GUI даже без ограничения темпа
+            time.sleep(max(self.min_interval - (time.perf_counter() - start), 0.001))
+    
+    def reset(self):
+        """Сброс частиц модели без гонки с шагом симуляции"""
+        with self.model_lock:
+            self.model.reset_particles()
+            self.publish()
+    
+    def stop(self):
+        self.stopped.set()
+        self.running.set()
 
 class InteractiveSwarmVisualizer:
     def __init__(self, model):
@@ -147,6 +552,17 @@ class InteractiveSwarmVisualizer:
         
         self.animation = None
         self.paused = False
+        self.sim_thread = None
+        self.threaded = False
+        self.substeps = 1
+        self.steps_per_second = None
+        self.snapshot = {name: np.empty(model.shape) for name in SwarmSimulationThread.fields}
+        self.fig.canvas.mpl_connect('close_event', self.on_close)
+        
+        # Режим повтора записанной траектории (см. load_replay)
+        self.replay = None
+        self.replay_index = 0
+        self.replay_slider = None
         self.setup_controls()
         self.setup_visualization()
         
@@ -214,7 +630,7 @@ class InteractiveSwarmVisualizer:
         
         # Визуализация частиц с цветом по энергии
         self.scatter = self.ax.scatter(self.model.x, self.model.y, 
-                                     c=self.model.energy, cmap=self.cmap, 
+                                     c=self.model.energy, cmap=self.cmap, norm=self.norm,
                                      s=40, alpha=0.8, edgecolors='black', linewidth=0.5)
         
         # Векторы скорости (изначально пустые)
@@ -236,25 +652,43 @@ class InteractiveSwarmVisualizer:
         # Цветовая шкала
         plt.colorbar(self.scatter, ax=self.ax, label='Энергия взаимодействия', 
                      shrink=0.8, pad=0.02)
+        
+        # Предвыделенные буферы для позиций и векторов скорости,
+        # чтобы не создавать новые массивы на каждом кадре
+        self.offsets = np.empty((self.model.N, 2))
+        self.U = np.empty(self.model.N)
+        self.V = np.empty(self.model.N)
     
     def update_parameters(self, val):
         """Обновление параметров модели"""
-        self.model.v0 = self.slider_velocity.val
-        self.model.R = self.slider_radius.val
-        self.model.eta = self.slider_noise.val
-        self.model.alignment_strength = self.slider_align.val
-        self.model.cohesion_strength = self.slider_cohesion.val
-        self.model.separation_strength = self.slider_separation.val
+        # Шаг в потоке читает R несколько раз: параметры меняются только между шагами
+        lock = (self.sim_thread.model_lock if self.sim_thread is not None
+                else contextlib.nullcontext())
+        with lock:
+            self.model.v0 = self.slider_velocity.val
+            self.model.R = self.slider_radius.val
+            self.model.eta = self.slider_noise.val
+            self.model.alignment_strength = self.slider_align.val
+            self.model.cohesion_strength = self.slider_cohesion.val
+            self.model.separation_strength = self.slider_separation.val
     
     def reset_simulation(self, event):
         """Сброс симуляции"""
-        self.model.reset_particles()
+        if self.sim_thread is not None:
+            self.sim_thread.reset()
+        else:
+            self.model.reset_particles()
         self.update_display()
+        self.fig.canvas.draw_idle()
     
     def pause_animation(self, event):
         """Пауза анимации"""
         if self.animation and not self.paused:
-            self.animation.event_source.stop()
+            # pause() также снимает флаг animated, и на паузе частицы
+            # остаются видимыми при полной перерисовке
+            self.animation.pause()
+            if self.sim_thread is not None:
+                self.sim_thread.running.clear()
             self.paused = True
             self.status_text.set_text('❚❚ ПАУЗА')
             self.status_text.set_color('red')
@@ -265,7 +699,9 @@ class InteractiveSwarmVisualizer:
     def resume_animation(self, event):
         """Продолжение анимации"""
         if self.animation and self.paused:
-            self.animation.event_source.start()
+            self.animation.resume()
+            if self.sim_thread is not None:
+                self.sim_thread.running.set()
             self.paused = False
             self.status_text.set_text('▶ АНИМАЦИЯ')
             self.status_text.set_color('green')
@@ -285,48 +721,247 @@ class InteractiveSwarmVisualizer:
         self.status_text.set_color('green')
         plt.draw()
     
+    def on_close(self, event):
+        """Закрытие окна: остановка потока и завершение записи"""
+        self.stop_simulation_thread()
+        self.model.stop_recording()
+    
+    def load_replay(self, path):
+        """Переход в режим повтора записи SwarmRecorder.
+        
+        Физика не считается: кадры читаются из файла по индексу,
+        слайдер внизу окна перематывает запись.
+        """
+        frames, meta = load_recording(path)
+        if len(frames) == 0:
+            raise ValueError(f"В записи {path} нет ни одного шага")
+        self.stop_simulation_thread()
+        self.replay = frames
+        self.replay_index = 0
+        self.ax.set_xlim(0, meta['L'])
+        self.ax.set_ylim(0, meta['L'])
+        
+        if self.replay_slider is None:
+            ax_replay = plt.axes([0.25, 0.005, 0.6, 0.025])
+            # Ручка слайдера не анимируется при блиттинге, поэтому скрыта
+            self.replay_slider = Slider(ax_replay, 'Запись', 0, 1, valinit=0, valstep=1,
+                                        handle_style={'size': 0})
+            self.replay_slider.drawon = False
+            self.replay_slider.on_changed(self.scrub_replay)
+        self.replay_slider.valmax = max(len(self.replay) - 1, 1)
+        self.replay_slider.ax.set_xlim(0, self.replay_slider.valmax)
+        self.replay_slider.set_val(0)
+        self.fig.canvas.draw_idle()
+    
+    def scrub_replay(self, val):
+        """Перемотка записи слайдером"""
+        self.replay_index = int(val)
+        self.update_display()
+        self.fig.canvas.draw_idle()
+    
+    def replay_state(self):
+        """Состояние текущего кадра записи (для ансамбля - первая реплика)"""
+        frame = self.replay[self.replay_index]
+        if frame.ndim == 3:
+            frame = frame[:, 0]
+        x, y, theta = frame
+        return {'x': x, 'y': y, 'theta': theta,
+                'velocity': np.full(theta.shape, self.model.v0),
+                'energy': np.zeros(theta.shape),
+                'neighbor_count': np.zeros(theta.shape)}
+    
+    def current_state(self):
+        """Состояние для отрисовки: кадр записи, последний снимок потока симуляции или сама модель"""
+        if self.replay is not None:
+            return self.replay_state()
+        if self.sim_thread is None:
+            return {name: getattr(self.model, name) for name in SwarmSimulationThread.fields}
+        return self.sim_thread.copy_latest(self.snapshot)
+    
     def update_display(self):
         """Обновление отображения без шага симуляции"""
-        # Обновление scatter plot
-        colors = self.cmap(self.norm(self.model.energy))
-        self.scatter.set_offsets(np.column_stack([self.model.x, self.model.y]))
-        self.scatter.set_array(self.model.energy)
+        state = self.current_state()
+        
+        # Обновление scatter plot (цвета по energy считает сам scatter через cmap/norm)
+        self.offsets[:, 0] = state['x']
+        self.offsets[:, 1] = state['y']
+        self.scatter.set_offsets(self.offsets)
+        self.scatter.set_array(state['energy'])
         
         # Обновление векторов скорости
-        self.quiver.set_offsets(np.column_stack([self.model.x, self.model.y]))
-        self.quiver.set_UVC(self.model.velocity * np.cos(self.model.theta),
-                          self.model.velocity * np.sin(self.model.theta))
+        self.quiver.set_offsets(self.offsets)
+        np.cos(state['theta'], out=self.U)
+        np.sin(state['theta'], out=self.V)
+        self.U *= state['velocity']
+        self.V *= state['velocity']
+        self.quiver.set_UVC(self.U, self.V)
         
         # Обновление статистики
-        avg_neighbors = np.mean(self.model.neighbor_count)
-        order_parameter = self.model.calculate_order_parameter()
+        avg_neighbors = np.mean(state['neighbor_count'])
+        order_parameter = self.model.calculate_order_parameter(state['theta'])
         stats = (f'Частиц: {self.model.N}\n'
                 f'Среднее соседей: {avg_neighbors:.1f}\n'
                 f'Параметр порядка: {order_parameter:.3f}\n'
-                f'Средняя скорость: {np.mean(self.model.velocity):.2f}\n'
+                f'Средняя скорость: {np.mean(state["velocity"]):.2f}\n'
                 f'Уровень шума: {self.model.eta:.2f}')
+        if self.replay is not None:
+            stats = (f'Повтор записи: шаг {self.replay_index + 1} / {len(self.replay)}\n'
+                     f'Параметр порядка: {order_parameter:.3f}')
+        else:
+            if self.sim_thread is not None:
+                stats += f'\nШагов симуляции: {self.sim_thread.steps_done}'
+            stats += '\n' + self.model.profiler.report()
         self.stats_text.set_text(stats)
     
     def update_animation(self, frame):
         """Обновление анимации"""
-        if not self.paused:
-            self.model.update_swarm()
+        if self.replay is not None:
+            # Повтор: вместо шагов физики - переход на substeps кадров записи
+            if not self.paused and len(self.replay):
+                self.replay_index = (self.replay_index + self.substeps) % len(self.replay)
+                self.replay_slider.eventson = False
+                self.replay_slider.set_val(self.replay_index)
+                self.replay_slider.eventson = True
+            self.update_display()
+            return (self.scatter, self.quiver, self.stats_text, self.status_text,
+                    self.replay_slider.poly, self.replay_slider.valtext)
+        
+        # В потоковом режиме шаги делает SwarmSimulationThread, кадр только рисует
+        if not self.paused and self.sim_thread is None:
+            for _ in range(self.substeps):
+                self.model.update_swarm()
         
         self.update_display()
         
         return self.scatter, self.quiver, self.stats_text, self.status_text
     
-    def start_animation(self):
-        """Запуск анимации"""
+    def stop_simulation_thread(self):
+        """Остановка фонового потока симуляции"""
+        if self.sim_thread is not None:
+            self.sim_thread.stop()
+            self.sim_thread.join()
+            self.sim_thread = None
+    
+    def start_animation(self, threaded=None, substeps=None, steps_per_second=None):
+        """Запуск анимации.
+        
+        substeps - число шагов модели на кадр. threaded=True переносит
+        симуляцию в фоновый поток со своим темпом (steps_per_second, по
+        умолчанию без ограничения), а кадры рисуют последний снимок.
+        """
+        if threaded is not None:
+            self.threaded = threaded
+        if substeps is not None:
+            self.substeps = substeps
+        if steps_per_second is not None:
+            self.steps_per_second = steps_per_second
+        
+        self.stop_simulation_thread()
+        if self.threaded and self.replay is None:
+            self.sim_thread = SwarmSimulationThread(self.model, self.substeps,
+                                                    self.steps_per_second)
+            self.sim_thread.start()
+        
         self.animation = FuncAnimation(
             self.fig, 
             self.update_animation,
             frames=1000,  # Большое количество кадров
             interval=50,   # Интервал в миллисекундах
-            blit=False,
+            blit=True,     # Перерисовываются только частицы, стрелки и тексты
             repeat=True
         )
 
+def run_headless(model, steps, report_every=None):
+    """Прогон модели на steps шагов без отрисовки.
+    
+    Возвращает временной ряд параметра порядка (float32),
+    для ансамбля - формы (steps, replicas). При report_every каждые
+    report_every шагов печатается время фаз шага (p50/p95).
+    """
+    order = np.empty((steps,) + model.shape[:-1], dtype=np.float32)
+    for step in range(steps):
+        model.update_swarm()
+        order[step] = model.calculate_order_parameter()
+        if report_every and (step + 1) % report_every == 0:
+            print(f'Шаг {step + 1}/{steps}:')
+            print(model.profiler.report())
+    return order
+
+def _sweep_point(eta, N, R, steps, L, params, seed):
+    """Одна точка фазовой диаграммы (выполняется в процессе пула)"""
+    model = AdvancedSwarmModel(N=N, L=L, R=R, eta=eta, seed=seed)
+    for name, value in params.items():
+        setattr(model, name, value)
+    return run_headless(model, steps)
+
+def sweep_phase_diagram(etas, Ns, Rs, steps=500, output_path='swarm_phase_diagram.npz',
+                        L=25, processes=None, seed=None, **params):
+    """Перебор сетки (eta, N, R) на пуле процессов с записью результатов на диск.
+    
+    Для каждой точки сохраняется ряд параметра порядка длиной steps.
+    Результат - сжатый .npz с осями eta, N, R и массивом order
+    формы (len(etas), len(Ns), len(Rs), steps). Дополнительные параметры
+    модели (alignment_strength и т.п.) передаются через params.
+    Каждая точка получает свой дочерний поток от seed, поэтому результат
+    воспроизводим и не зависит от числа процессов.
+    
+    Готовые точки сразу пишутся в <output_path без .npz>.partial.npy
+    (незавершенные - NaN), так что при падении долгого перебора
+    посчитанное не теряется. После записи .npz этот файл удаляется.
+    """
+    grid = list(itertools.product(etas, Ns, Rs))
+    seeds = np.random.SeedSequence(seed).spawn(len(grid))
+    
+    partial_path = os.path.splitext(output_path)[0] + '.partial.npy'
+    order = np.lib.format.open_memmap(partial_path, mode='w+', dtype=np.float32,
+                                      shape=(len(etas), len(Ns), len(Rs), steps))
+    order[:] = np.nan
+    order.flush()
+    
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        futures = {pool.submit(_sweep_point, eta, N, R, steps, L, params, point_seed): index
+                   for index, ((eta, N, R), point_seed) in enumerate(zip(grid, seeds))}
+        for future in as_completed(futures):
+            order[np.unravel_index(futures[future], order.shape[:3])] = future.result()
+            order.flush()
+    
+    result = np.array(order)
+    del order
+    np.savez_compressed(output_path, eta=np.asarray(etas), N=np.asarray(Ns), R=np.asarray(Rs),
+                        L=L, order=result)
+    os.remove(partial_path)
+    return result
+
+def benchmark_neighbor_backends(Ns=(250, 1000, 5000, 20000), R=2.0, density=250 / 25**2,
+                                repeats=5, seed=0):
+    """Сравнение способов поиска соседей при постоянной плотности частиц"""
+    rng = np.random.default_rng(seed)
+    results = {}
+    for N in Ns:
+        L = np.sqrt(N / density)
+        x = rng.random(N) * L
+        y = rng.random(N) * L
+        
+        line = [f"N={N:6d}:"]
+        pair_counts = set()
+        for name, backend_class in NEIGHBOR_BACKENDS.items():
+            if not backend_class.supports(L, R):
+                continue
+            backend = backend_class()
+            start = time.perf_counter()
+            for _ in range(repeats):
+                backend.build(x, y, L, R)
+                i, j, dx, dy, dist = backend.query()
+            elapsed = (time.perf_counter() - start) / repeats
+            results[(N, name)] = elapsed
+            pair_counts.add(len(i))
+            line.append(f"{name} {elapsed * 1e3:8.2f} мс")
+        
+        # Все способы должны находить одни и те же пары
+        line.append("(пары совпадают)" if len(pair_counts) == 1 else "(РАЗНОЕ ЧИСЛО ПАР!)")
+        print("  ".join(line))
+    return results
+
 # Демонстрационная функция с разными сценариями
 def demonstrate_swarm_scenarios():
     """Демонстрация различных сценариев роевого поведения"""
@@ -372,10 +1007,26 @@ if __name__ == "__main__":
     
     # Создаем визуализатор
     visualizer = InteractiveSwarmVisualizer(swarm_model)
-    visualizer.start_animation()
+    visualizer.start_animation(threaded=True, substeps=2)
     
     # Показываем интерфейс
     plt.show()
     
     # Раскомментируйте для демонстрации разных сценариев:
-    # demonstrate_swarm_scenarios()
\ No newline at end of file
+    # demonstrate_swarm_scenarios()
+    
+    # Раскомментируйте для записи траекторий и последующего просмотра без пересчета:
+    # recorded_model = AdvancedSwarmModel(N=250, L=25, v0=2.0, R=2.0, eta=0.2)
+    # recorded_model.start_recording('swarm_trajectory.npy', max_steps=5000)
+    # run_headless(recorded_model, 5000)
+    # recorded_model.stop_recording()
+    # replay_visualizer = InteractiveSwarmVisualizer(recorded_model)
+    # replay_visualizer.load_replay('swarm_trajectory.npy')
+    # replay_visualizer.start_animation()
+    # plt.show()
+    
+    # Раскомментируйте для сравнения способов поиска соседей:
+    # benchmark_neighbor_backends()
+    
+    # Раскомментируйте для расчета фазовой диаграммы без отрисовки:
+    # sweep_phase_diagram(etas=np.linspace(0, 1, 11), Ns=[100, 250, 500], Rs=[1.0, 2.0], steps=1000)
\ No newline at end of file
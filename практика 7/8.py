@@ -1,14 +1,586 @@
+import ast
+import functools
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.widgets import Slider, Button, TextBox, RadioButtons
 import matplotlib.animation as animation
+from matplotlib.backend_bases import TimerBase
 from scipy import integrate
 
+# Разрешенные в выражениях функции и константы (np.sin и sin - одно и то же)
+EXPRESSION_FUNCTIONS = {
+    'sin': np.sin, 'cos': np.cos, 'tan': np.tan,
+    'arcsin': np.arcsin, 'arccos': np.arccos, 'arctan': np.arctan,
+    'sinh': np.sinh, 'cosh': np.cosh, 'tanh': np.tanh,
+    'exp': np.exp, 'log': np.log, 'log10': np.log10, 'sqrt': np.sqrt, 'abs': np.abs,
+}
+EXPRESSION_ALIASES = {'ln': 'log', 'arctg': 'arctan', 'tg': 'tan', 'fabs': 'abs'}
+EXPRESSION_CONSTANTS = {'pi': np.pi, 'e': np.e}
+EXPRESSION_OPERATORS = (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow, ast.USub, ast.UAdd)
+
+class ExpressionNormalizer(ast.NodeTransformer):
+    """Проверка AST выражения по белому списку и приведение к каноническому виду.
+    
+    np.sin/numpy.sin и синонимы (ln, tg) становятся sin/log/tan.
+    Любой другой узел (атрибуты, индексы, лямбды, строки...) - ValueError.
+    """
+    def visit_Expression(self, node):
+        node.body = self.visit(node.body)
+        return node
+    
+    def visit_BinOp(self, node):
+        if not isinstance(node.op, EXPRESSION_OPERATORS):
+            raise ValueError(f"Недопустимая операция: {type(node.op).__name__}")
+        node.left = self.visit(node.left)
+        node.right = self.visit(node.right)
+        return node
+    
+    def visit_UnaryOp(self, node):
+        if not isinstance(node.op, EXPRESSION_OPERATORS):
+            raise ValueError(f"Недопустимая операция: {type(node.op).__name__}")
+        node.operand = self.visit(node.operand)
+        return node
+    
+    def visit_Call(self, node):
+        if node.keywords or len(node.args) != 1:
+            raise ValueError("Функции принимают ровно один аргумент")
+        node.func = self.visit(node.func)
+        if node.func.id not in EXPRESSION_FUNCTIONS:
+            raise ValueError(f"Неизвестная функция: {node.func.id}")
+        node.args = [self.visit(node.args[0])]
+        return node
+    
+    def visit_Attribute(self, node):
+        if not (isinstance(node.value, ast.Name) and node.value.id in ('np', 'numpy')):
+            raise ValueError("Допустимы только атрибуты np.<функция>")
+        return self.visit(ast.copy_location(ast.Name(id=node.attr, ctx=ast.Load()), node))
+    
+    def visit_Name(self, node):
+        node.id = EXPRESSION_ALIASES.get(node.id, node.id)
+        if node.id != 'x' and node.id not in EXPRESSION_FUNCTIONS and node.id not in EXPRESSION_CONSTANTS:
+            raise ValueError(f"Неизвестное имя: {node.id}")
+        return node
+    
+    def visit_Constant(self, node):
+        if type(node.value) not in (int, float):
+            raise ValueError(f"Недопустимая константа: {node.value!r}")
+        # Целые числа Python не ограничены: 9**9**9 считалось бы бесконечно.
+        # В float такая степень просто переполняется
+        return ast.copy_location(ast.Constant(float(node.value)), node)
+    
+    def generic_visit(self, node):
+        raise ValueError(f"Недопустимый элемент выражения: {type(node).__name__}")
+
+class CompiledFunction:
+    """Выражение f(x), скомпилированное в векторизованную функцию NumPy"""
+    def __init__(self, source, tree):
+        self.source = source  # нормализованный текст выражения
+        self.tree = tree      # ast.Expression
+        
+        # Выражение компилируется один раз как lambda x: <выражение>
+        # с пространством имен только из разрешенных функций и констант
+        code = compile(ast.fix_missing_locations(ast.Expression(ast.Lambda(
+            args=ast.arguments(posonlyargs=[], args=[ast.arg(arg='x')], kwonlyargs=[],
+                               kw_defaults=[], defaults=[]),
+            body=tree.body))), f'<f(x) = {source}>', 'eval')
+        namespace = {'__builtins__': {}, **EXPRESSION_FUNCTIONS, **EXPRESSION_CONSTANTS}
+        self.func = eval(code, namespace)
+    
+    def __call__(self, x):
+        # Числа приводятся к NumPy, чтобы (-1)**0.5 давало nan, а не complex
+        return self.func(np.asarray(x, dtype=float))
+    
+    @functools.cached_property
+    def derivative(self):
+        """Символьная производная (CompiledFunction)"""
+        return _compile_normalized(ast.unparse(differentiate(self.tree.body)))
+    
+    @functools.cached_property
+    def antiderivative(self):
+        """Символьная первообразная или None, если правила ее не находят"""
+        node = antiderivative(self.tree.body)
+        return None if node is None else _compile_normalized(ast.unparse(node))
+
+# === Символьное дифференцирование и интегрирование на AST ===
+# Узлы строятся через конструкторы с простейшими упрощениями (0 + a, 1 * a, ...),
+# чтобы результат оставался читаемым
+
+X = ast.Name(id='x', ctx=ast.Load())
+
+def _number(node):
+    """Числовое значение узла-константы или None"""
+    if isinstance(node, ast.Constant):
+        return node.value
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+        value = _number(node.operand)
+        return None if value is None else -value
+    return None
+
+def _const(value):
+    return ast.Constant(value) if value >= 0 else ast.UnaryOp(ast.USub(), ast.Constant(-value))
+
+def _neg(a):
+    value = _number(a)
+    if value is not None:
+        return _const(-value)
+    if isinstance(a, ast.UnaryOp) and isinstance(a.op, ast.USub):
+        return a.operand
+    return ast.UnaryOp(ast.USub(), a)
+
+def _add(a, b):
+    va, vb = _number(a), _number(b)
+    if va is not None and vb is not None:
+        return _const(va + vb)
+    if va == 0:
+        return b
+    if vb == 0:
+        return a
+    return ast.BinOp(a, ast.Add(), b)
+
+def _sub(a, b):
+    va, vb = _number(a), _number(b)
+    if va is not None and vb is not None:
+        return _const(va - vb)
+    if vb == 0:
+        return a
+    if va == 0:
+        return _neg(b)
+    return ast.BinOp(a, ast.Sub(), b)
+
+def _mul(a, b):
+    va, vb = _number(a), _number(b)
+    if va is not None and vb is not None:
+        return _const(va * vb)
+    if va == 0 or vb == 0:
+        return ast.Constant(0)
+    if va == 1:
+        return b
+    if vb == 1:
+        return a
+    if va == -1:
+        return _neg(b)
+    if vb == -1:
+        return _neg(a)
+    return ast.BinOp(a, ast.Mult(), b)
+
+def _div(a, b):
+    if _number(a) == 0:
+        return ast.Constant(0)
+    if _number(b) == 1:
+        return a
+    return ast.BinOp(a, ast.Div(), b)
+
+def _pow(a, n):
+    vn = _number(n)
+    if vn == 0:
+        return ast.Constant(1)
+    if vn == 1:
+        return a
+    return ast.BinOp(a, ast.Pow(), n)
+
+def _call(name, arg):
+    return ast.Call(ast.Name(id=name, ctx=ast.Load()), [arg], [])
+
+def _is_constant(node):
+    """Не зависит ли узел от x"""
+    return not any(isinstance(n, ast.Name) and n.id == 'x' for n in ast.walk(node))
+
+def _constant_value(node):
+    """Числовое значение постоянного выражения (например, 1/2 или pi)"""
+    return float(_compile_normalized(ast.unparse(node))(0.0))
+
+# Производные функций по аргументу u: f'(u)
+DERIVATIVE_RULES = {
+    'sin': lambda u: _call('cos', u),
+    'cos': lambda u: _neg(_call('sin', u)),
+    'tan': lambda u: _div(ast.Constant(1), _pow(_call('cos', u), ast.Constant(2))),
+    'arcsin': lambda u: _div(ast.Constant(1), _call('sqrt', _sub(ast.Constant(1), _pow(u, ast.Constant(2))))),
+    'arccos': lambda u: _neg(_div(ast.Constant(1), _call('sqrt', _sub(ast.Constant(1), _pow(u, ast.Constant(2)))))),
+    'arctan': lambda u: _div(ast.Constant(1), _add(ast.Constant(1), _pow(u, ast.Constant(2)))),
+    'sinh': lambda u: _call('cosh', u),
+    'cosh': lambda u: _call('sinh', u),
+    'tanh': lambda u: _div(ast.Constant(1), _pow(_call('cosh', u), ast.Constant(2))),
+    'exp': lambda u: _call('exp', u),
+    'log': lambda u: _div(ast.Constant(1), u),
+    'log10': lambda u: _div(ast.Constant(1), _mul(u, _call('log', ast.Constant(10)))),
+    'sqrt': lambda u: _div(ast.Constant(1), _mul(ast.Constant(2), _call('sqrt', u))),
+    'abs': lambda u: _div(u, _call('abs', u)),
+}
+
+# Первообразные функций по линейному аргументу u (без деления на u')
+ANTIDERIVATIVE_RULES = {
+    'sin': lambda u: _neg(_call('cos', u)),
+    'cos': lambda u: _call('sin', u),
+    'tan': lambda u: _neg(_call('log', _call('abs', _call('cos', u)))),
+    'sinh': lambda u: _call('cosh', u),
+    'cosh': lambda u: _call('sinh', u),
+    'tanh': lambda u: _call('log', _call('cosh', u)),
+    'exp': lambda u: _call('exp', u),
+    'log': lambda u: _sub(_mul(u, _call('log', u)), u),
+    'sqrt': lambda u: _mul(_div(ast.Constant(2), ast.Constant(3)), _pow(u, ast.Constant(1.5))),
+    'abs': lambda u: _div(_mul(u, _call('abs', u)), ast.Constant(2)),
+}
+
+def differentiate(node):
+    """Символьная производная выражения по x (AST -> AST)"""
+    if _is_constant(node):
+        return ast.Constant(0)
+    if isinstance(node, ast.Name):
+        return ast.Constant(1)
+    if isinstance(node, ast.UnaryOp):
+        du = differentiate(node.operand)
+        return _neg(du) if isinstance(node.op, ast.USub) else du
+    if isinstance(node, ast.Call):
+        u = node.args[0]
+        return _mul(DERIVATIVE_RULES[node.func.id](u), differentiate(u))
+    
+    u, v = node.left, node.right
+    du, dv = differentiate(u), differentiate(v)
+    if isinstance(node.op, ast.Add):
+        return _add(du, dv)
+    if isinstance(node.op, ast.Sub):
+        return _sub(du, dv)
+    if isinstance(node.op, ast.Mult):
+        return _add(_mul(du, v), _mul(u, dv))
+    if isinstance(node.op, ast.Div):
+        if _is_constant(v):
+            return _div(du, v)
+        return _div(_sub(_mul(du, v), _mul(u, dv)), _pow(v, ast.Constant(2)))
+    # Степень: u**n, a**v или общий случай u**v
+    if _is_constant(v):
+        return _mul(_mul(v, _pow(u, _sub(v, ast.Constant(1)))), du)
+    if _is_constant(u):
+        return _mul(_mul(node, _call('log', u)), dv)
+    return _mul(node, _add(_mul(dv, _call('log', u)), _div(_mul(v, du), u)))
+
+def _linear_slope(node):
+    """Коэффициент a, если узел - линейная функция a*x + b, иначе None"""
+    if _is_constant(node):
+        return None
+    slope = differentiate(node)
+    return slope if _is_constant(slope) else None
+
+def _power_antiderivative(u, n):
+    """Первообразная u**n для линейного u"""
+    slope = _linear_slope(u)
+    if slope is None:
+        return None
+    if _constant_value(n) == -1:
+        return _div(_call('log', _call('abs', u)), slope)
+    n1 = _add(n, ast.Constant(1))
+    return _div(_pow(u, n1), _mul(n1, slope))
+
+def _is_one_plus_x_squared(node):
+    """Является ли узел выражением 1 + x**2 (в любом порядке слагаемых)"""
+    if not (isinstance(node, ast.BinOp) and isinstance(node.op, ast.Add)):
+        return False
+    for one, square in ((node.left, node.right), (node.right, node.left)):
+        if (_number(one) == 1 and isinstance(square, ast.BinOp) and isinstance(square.op, ast.Pow)
+                and isinstance(square.left, ast.Name) and square.left.id == 'x'
+                and _number(square.right) == 2):
+            return True
+    return False
+
+def antiderivative(node):
+    """Символьная первообразная по x или None.
+    
+    Поддерживаются линейность, степени и функции таблицы от линейного
+    аргумента, c/(a*x + b)^n и c/(1 + x^2).
+    """
+    if _is_constant(node):
+        return _mul(node, X)
+    if isinstance(node, ast.Name):
+        return _div(_pow(X, ast.Constant(2)), ast.Constant(2))
+    if isinstance(node, ast.UnaryOp):
+        F = antiderivative(node.operand)
+        if F is None or isinstance(node.op, ast.UAdd):
+            return F
+        return _neg(F)
+    if isinstance(node, ast.Call):
+        u = node.args[0]
+        slope = _linear_slope(u)
+        if slope is None or node.func.id not in ANTIDERIVATIVE_RULES:
+            return None
+        return _div(ANTIDERIVATIVE_RULES[node.func.id](u), slope)
+    
+    u, v = node.left, node.right
+    if isinstance(node.op, (ast.Add, ast.Sub)):
+        Fu, Fv = antiderivative(u), antiderivative(v)
+        if Fu is None or Fv is None:
+            return None
+        return _add(Fu, Fv) if isinstance(node.op, ast.Add) else _sub(Fu, Fv)
+    if isinstance(node.op, ast.Mult):
+        if _is_constant(u):
+            F = antiderivative(v)
+            return None if F is None else _mul(u, F)
+        if _is_constant(v):
+            F = antiderivative(u)
+            return None if F is None else _mul(F, v)
+        return None
+    if isinstance(node.op, ast.Div):
+        if _is_constant(v):
+            F = antiderivative(u)
+            return None if F is None else _div(F, v)
+        if not _is_constant(u):
+            return None
+        if _is_one_plus_x_squared(v):
+            return _mul(u, _call('arctan', X))
+        if isinstance(v, ast.BinOp) and isinstance(v.op, ast.Pow) and _is_constant(v.right):
+            F = _power_antiderivative(v.left, _neg(v.right))
+        else:
+            F = _power_antiderivative(v, ast.Constant(-1))
+        return None if F is None else _mul(u, F)
+    # Степень: u**n с линейным u или a**(линейное)
+    if _is_constant(v):
+        return _power_antiderivative(u, v)
+    slope = _linear_slope(v)
+    if _is_constant(u) and slope is not None:
+        return _div(node, _mul(_call('log', u), slope))
+    return None
+
+def normalize_expression(text):
+    """Разбор текста в проверенный AST и его канонический текст"""
+    # '^' - степень; замена до разбора сохраняет приоритет (-x^2 = -(x**2)),
+    # а другого смысла у '^' в разрешенных выражениях нет
+    try:
+        tree = ast.parse(text.strip().replace('^', '**'), mode='eval')
+    except SyntaxError as e:
+        raise ValueError(f"Синтаксическая ошибка: {e.msg}") from None
+    tree = ExpressionNormalizer().visit(tree)
+    return ast.unparse(tree), tree
+
+@functools.lru_cache(maxsize=256)
+def _compile_normalized(source):
+    return CompiledFunction(source, ast.parse(source, mode='eval'))
+
+@functools.lru_cache(maxsize=256)
+def compile_expression(text):
+    """Компиляция выражения от x с кэшированием.
+    
+    Кэш по исходному тексту позволяет повторному вводу пропустить разбор,
+    кэш по нормализованному тексту - переиспользовать функцию для разных
+    записей одного выражения (sin(x)^2 и np.sin(x)**2).
+    """
+    source, _ = normalize_expression(text)
+    return _compile_normalized(source)
+
+# Коэффициенты центральных разностей для первой производной:
+# порядок точности -> (смещения k, веса w), f'(x) ~ sum(w * f(x + k*h)) / h
+CENTRAL_DIFFERENCE_STENCILS = {
+    2: ((-1, 1), (-1/2, 1/2)),
+    4: ((-2, -1, 1, 2), (1/12, -8/12, 8/12, -1/12)),
+    6: ((-3, -2, -1, 1, 2, 3), (-1/60, 9/60, -45/60, 45/60, -9/60, 1/60)),
+}
+
+# Узлы и веса квадратуры Гаусса-Лежандра на [-1, 1]
+GAUSS_NODES, GAUSS_WEIGHTS = np.polynomial.legendre.leggauss(5)
+
+def evaluate(func, x):
+    """Значения func на массиве x (константа растягивается до формы x)"""
+    return np.broadcast_to(np.asarray(func(x), dtype=float), np.shape(x))
+
+def _gauss_segments(func, a, b):
+    """Интегралы по отрезкам [a_k, b_k] одним вызовом func на все узлы"""
+    mid = (a + b) / 2
+    half = (b - a) / 2
+    points = mid[:, None] + half[:, None] * GAUSS_NODES
+    return half * (evaluate(func, points) @ GAUSS_WEIGHTS)
+
+def cumulative_integral(func, x, lower=-5, tol=1e-10, max_depth=20, max_segments=200_000):
+    """Интеграл func от lower до каждой точки отсортированной сетки x за один проход.
+    
+    Каждый интервал сетки (шаг может быть неравномерным) считается квадратурой
+    Гаусса-Лежандра; где она расходится с суммой по двум половинам, интервал
+    делится пополам - до max_depth раз и не более max_segments отрезков
+    за проход, одновременно для всех таких интервалов. Интервалы с NaN/inf
+    (полюса, вне области определения) не уточняются.
+    Затем значения накапливаются cumsum, а отрезок от lower до x[0]
+    добавляется одним вызовом quad.
+    """
+    x = np.asarray(x, dtype=float)
+    a, b = x[:-1], x[1:]
+    owner = np.arange(len(a))
+    coarse = _gauss_segments(func, a, b)
+    segments = np.zeros(len(a))
+    
+    for depth in range(max_depth):
+        mid = (a + b) / 2
+        left = _gauss_segments(func, a, mid)
+        right = _gauss_segments(func, mid, b)
+        fine = left + right
+        
+        done = (np.abs(fine - coarse) <= tol * np.maximum(1.0, np.abs(fine))) | ~np.isfinite(fine)
+        if depth == max_depth - 1 or 2 * np.count_nonzero(~done) > max_segments:
+            done[:] = True
+        segments += np.bincount(owner[done], weights=fine[done], minlength=len(segments))
+        if done.all():
+            break
+        
+        # Жесткие интервалы делятся пополам
+        stiff = ~done
+        a = np.concatenate([a[stiff], mid[stiff]])
+        b = np.concatenate([mid[stiff], b[stiff]])
+        owner = np.tile(owner[stiff], 2)
+        coarse = np.concatenate([left[stiff], right[stiff]])
+    
+    offset = integrate.quad(func, lower, x[0])[0] if x[0] != lower else 0.0
+    return offset + np.concatenate([[0.0], np.cumsum(segments)])
+
+def adaptive_sample(func, a, b, budget=1000, initial=129, tol=2e-3, min_step=1e-9):
+    """Адаптивная сетка для графика func на [a, b] не более чем из budget точек.
+    
+    Начинает с грубой равномерной сетки и добавляет середины интервалов там,
+    где точка отклоняется от прямой через соседей больше tol масштаба кривой
+    (большая кривизна) или где функция определена только на одном конце
+    (граница области, полюс). Масштаб - размах 5..95 процентилей, чтобы
+    значения у полюса не делали остальную кривую "плоской". Заметный скачок,
+    наклон которого не согласуется с обоими соседями (другой знак - полюс,
+    на порядок круче - разрыв), считается разрывом: в него вставляется
+    точка с NaN, чтобы линия не соединяла ветви. Эти точки входят в budget.
+    Бесконечные значения (полюс точно в узле) тоже заменяются на NaN.
+    
+    Возвращает отсортированные x и значения y.
+    """
+    x = np.linspace(a, b, min(initial, budget))
+    y = np.array(evaluate(func, x))
+    finite = y[np.isfinite(y)]
+    scale = np.subtract(*np.percentile(finite, [95, 5])) if finite.size else 0.0
+    scale = scale if scale > 0 else 1.0
+    min_width = min_step * (b - a)
+    
+    while True:
+        # Отклонение внутренних точек от хорды через соседей
+        with np.errstate(invalid='ignore'):
+            t = (x[1:-1] - x[:-2]) / (x[2:] - x[:-2])
+            deviation = np.abs(y[1:-1] - (y[:-2] + t * (y[2:] - y[:-2])))
+        deviation = np.nan_to_num(deviation, nan=0.0, posinf=0.0)
+        
+        # Вес интервала - наибольшее отклонение в его концах
+        weight = np.zeros(len(x) - 1)
+        weight[:-1] = deviation
+        weight[1:] = np.maximum(weight[1:], deviation)
+        edge = np.isfinite(y[:-1]) != np.isfinite(y[1:])
+        weight[edge] = np.inf
+        
+        flagged = (weight > tol * scale) & (np.diff(x) > min_width)
+        room = budget - len(x) - len(discontinuities(x, y, scale))
+        if room <= 0 or not flagged.any():
+            break
+        index = np.flatnonzero(flagged)
+        if len(index) > room:
+            index = index[np.argsort(weight[index])[::-1][:room]]
+        
+        mid = (x[index] + x[index + 1]) / 2
+        order = np.argsort(np.concatenate([x, mid]), kind='stable')
+        x = np.concatenate([x, mid])[order]
+        y = np.concatenate([y, evaluate(func, mid)])[order]
+    
+    y = np.where(np.isfinite(y), y, np.nan)
+    index = discontinuities(x, y, scale)
+    excess = len(x) + len(index) - budget
+    if excess > 0:
+        # Новые разрывы после последнего шага: оставляем самые большие скачки
+        keep = np.argsort(np.abs(np.diff(y)[index]))[::-1][:max(len(index) - excess, 0)]
+        index = np.sort(index[keep])
+    if len(index):
+        x = np.insert(x, index + 1, (x[index] + x[index + 1]) / 2)
+        y = np.insert(y, index + 1, np.nan)
+    return x, y
+
+def discontinuities(x, y, scale):
+    """Индексы интервалов сетки с разрывом: заметный скачок (больше 5% scale),
+    наклон которого не согласуется с обоими соседями"""
+    with np.errstate(invalid='ignore', divide='ignore'):
+        slope = np.diff(y) / np.diff(x)
+        jump = np.abs(np.diff(y)) > 0.05 * scale
+        left = np.concatenate([[np.nan], slope[:-1]])
+        right = np.concatenate([slope[1:], [np.nan]])
+        flipped = (np.sign(slope) != np.sign(left)) & (np.sign(slope) != np.sign(right))
+        steeper = np.abs(slope) > 10 * np.fmax(np.abs(left), np.abs(right))
+    neighbors = np.isfinite(left) & np.isfinite(right)
+    return np.flatnonzero(jump & neighbors & (flipped | steeper))
+
+def weighted_percentile(x, y, q):
+    """Процентили q (доли 0..1) конечных значений y, взвешенных длиной участков сетки x.
+    
+    На адаптивной сетке точки сгущаются у полюсов, и обычные процентили
+    смещались бы к большим значениям. Возвращает None, если конечных значений нет.
+    """
+    mask = np.isfinite(y)
+    if not mask.any():
+        return None
+    finite = y[mask]
+    width = np.gradient(x)[mask] if len(x) > 1 else np.ones(1)
+    order = np.argsort(finite)
+    cumulative = np.cumsum(width[order])
+    return np.interp(q, cumulative / cumulative[-1], finite[order])
+
+def singular_points(func, a, b, n=513, iterations=50, decades=8):
+    """Неинтегрируемые особенности func на [a, b] (полюса вида 1/x, tan).
+    
+    Кандидаты - локальные максимумы |func| на равномерной сетке, включая
+    узлы с бесконечным значением. Оба соседних с максимумом интервала
+    сужаются бисекцией к концу с большим |func|. Особенность p неинтегрируема,
+    если |func(p ± d)|·d не убывает к нулю: при уменьшении d в 10**decades раз
+    произведение не падает вдвое. Интегрируемые особенности (log|x|,
+    1/sqrt|x|), конечные скачки и обычные максимумы полюсами не считаются.
+    """
+    with np.errstate(all='ignore'):
+        x = np.linspace(a, b, n)
+        y = np.abs(evaluate(func, x))
+        
+        level = np.where(np.isnan(y), -np.inf, y)
+        padded = np.concatenate([[-np.inf], level, [-np.inf]])
+        peak = np.flatnonzero((level >= padded[:-2]) & (level >= padded[2:]))
+        lo = np.concatenate([x[np.maximum(peak - 1, 0)], x[peak]])
+        hi = np.concatenate([x[peak], x[np.minimum(peak + 1, n - 1)]])
+        f_lo = np.abs(evaluate(func, lo))
+        f_hi = np.abs(evaluate(func, hi))
+        
+        for _ in range(iterations):
+            mid = (lo + hi) / 2
+            f_mid = np.abs(evaluate(func, mid))
+            toward_lo = f_lo >= f_hi
+            hi, f_hi = np.where(toward_lo, mid, hi), np.where(toward_lo, f_mid, f_hi)
+            lo, f_lo = np.where(toward_lo, lo, mid), np.where(toward_lo, f_lo, f_mid)
+        
+        candidates = np.where(f_lo >= f_hi, lo, hi)
+        
+        def growth(d):
+            return np.fmax(np.abs(evaluate(func, candidates - d)),
+                           np.abs(evaluate(func, candidates + d))) * d
+        
+        step = (b - a) / (n - 1)
+        far = growth(step / 10)
+        near = growth(step / 10**decades)
+        poles = candidates[near >= far / 2]
+    return np.unique(poles)
+
+def check_integral_accuracy(func, x, lower=-5, samples=20):
+    """Проверка cumulative_integral по quad в samples точках сетки.
+    
+    Возвращает максимальную абсолютную ошибку.
+    """
+    x = np.asarray(x, dtype=float)
+    values = cumulative_integral(func, x, lower)
+    index = np.linspace(0, len(x) - 1, samples).astype(int)
+    reference = np.array([integrate.quad(func, lower, x[k], epsabs=1e-13, limit=200)[0]
+                          for k in index])
+    return np.max(np.abs(values[index] - reference))
+
 class CalculusGrapher:
-    def __init__(self):
-        self.x = np.linspace(-5, 5, 1000)
+    def __init__(self, derivative_order=4):
+        # Кривые строятся на адаптивной сетке (adaptive_sample) в пределах
+        # [-x_range, x_range] с бюджетом sample_budget точек
+        self.x_range = 5
+        self.sample_budget = 800
+        # Особые точки текущей функции: ((функция, полуширина отрезка), точки)
+        self.singular_cache = (None, None)
         self.function_str = "np.sin(x)"
-        self.current_function = lambda x: np.sin(x)
+        self.current_function = compile_expression(self.function_str)
+        
+        # Порядок точности численной производной (2, 4 или 6)
+        self.derivative_order = derivative_order
         
         # Параметры для анимации
         self.animation_running = False
@@ -16,9 +588,21 @@ class CalculusGrapher:
         
         self.setup_ui()
         
-    def numerical_derivative(self, func, x, dx=1e-6):
-        """Численная производная"""
-        return (func(x + dx) - func(x - dx)) / (2 * dx)
+    def numerical_derivative(self, func, x, dx=None, order=None):
+        """Численная производная центральной разностью.
+        
+        Работает сразу на всем массиве x: по одному вызову func на каждое
+        смещение шаблона. Если dx не задан, шаг подбирается под порядок
+        точности, чтобы уравновесить ошибки усечения и округления.
+        """
+        order = self.derivative_order if order is None else order
+        offsets, weights = CENTRAL_DIFFERENCE_STENCILS[order]
+        x = np.asarray(x, dtype=float)
+        if dx is None:
+            dx = np.finfo(float).eps ** (1 / (order + 1)) * np.maximum(1.0, np.abs(x))
+        
+        result = sum(w * func(x + k * dx) for k, w in zip(offsets, weights)) / dx
+        return np.broadcast_to(result, x.shape) if np.ndim(result) < x.ndim else result
     
     def setup_ui(self):
         """Настройка пользовательского интерфейса с рациональным размещением"""
@@ -51,14 +635,16 @@ class CalculusGrapher:
         self.ax_integral.set_xlabel('x', fontsize=12)
         self.ax_integral.set_title('ИНТЕГРАЛ', fontweight='bold', pad=15, fontsize=14)
         
-        # Инициализация графиков
-        self.func_line, = self.ax_func.plot(self.x, self.current_function(self.x), 
+        # Инициализация графиков (кривые запоминаются для быстрого перекрестия)
+        self.curves = self.compute_curves()
+        
+        self.func_line, = self.ax_func.plot(self.x, self.curves[1], 
                                           'b-', linewidth=2, label='f(x)')
         
-        self.deriv_line, = self.ax_deriv.plot(self.x, [self.numerical_derivative(self.current_function, xi) for xi in self.x], 
+        self.deriv_line, = self.ax_deriv.plot(self.x, self.curves[2], 
                                             'r-', linewidth=2, label="f'(x)")
         
-        self.integral_line, = self.ax_integral.plot(self.x, [self.calculate_integral(xi) for xi in self.x], 
+        self.integral_line, = self.ax_integral.plot(self.x, self.curves[3], 
                                                   'g-', linewidth=2, label='∫f(x)dx')
         
         # Точки для визуализации
@@ -78,6 +664,7 @@ class CalculusGrapher:
         self.ax_panel.axis('off')
         
         self.setup_controls()
+        self.setup_update_scheduler()
         self.update_crosshair(0)
         
         # Настройка нижней панели управления
@@ -113,7 +700,7 @@ class CalculusGrapher:
         # Слайдер для выбора точки (слева внизу)
         ax_slider = plt.axes([0.15, 0.08, 0.3, 0.03])
         self.slider = Slider(ax_slider, 'Точка анализа x', -5, 5, valinit=0, valfmt='%.2f')
-        self.slider.on_changed(self.update_crosshair)
+        self.slider.on_changed(lambda val: self.schedule_update())
         
         # Слайдер для диапазона (справа от слайдера точки)
         ax_range = plt.axes([0.15, 0.03, 0.3, 0.03])
@@ -134,100 +721,184 @@ class CalculusGrapher:
         self.ax_deriv.legend(loc='upper right', fontsize=10)
         self.ax_integral.legend(loc='upper right', fontsize=10)
         
+    def setup_update_scheduler(self):
+        """Планировщик обновлений: события слайдеров за один кадр (~16 мс)
+        сливаются в одно обновление, дешевое (только перекрестие) или
+        полное (пересчет кривых)."""
+        self.pending_curves = False
+        self.pending_crosshair = False
+        self.update_timer = self.fig.canvas.new_timer(interval=16)
+        self.update_timer.single_shot = True
+        self.update_timer.add_callback(self.flush_updates)
+        self.update_scheduled = False
+        # У неинтерактивных бэкендов (Agg) таймер не срабатывает - обновляем сразу
+        self.deferred_updates = type(self.update_timer) is not TimerBase
+    
+    def schedule_update(self, curves=False):
+        """Запрос обновления: curves=True - пересчет кривых, иначе только перекрестие"""
+        self.pending_curves |= curves
+        self.pending_crosshair = True
+        if not self.deferred_updates:
+            self.flush_updates()
+        elif not self.update_scheduled:
+            self.update_scheduled = True
+            self.update_timer.start()
+    
+    def flush_updates(self, draw=True):
+        """Выполнение накопленных обновлений и одна перерисовка.
+        
+        draw=False - без перерисовки перекрестия, когда кадр и так рисует
+        вызывающий код (анимация); отложенный запуск при этом отменяется.
+        """
+        if self.update_scheduled:
+            self.update_timer.stop()
+        self.update_scheduled = False
+        if self.pending_curves:
+            self.update_plots()
+        elif self.pending_crosshair:
+            self.update_crosshair(self.slider.val)
+            if draw:
+                self.fig.canvas.draw_idle()
+        self.pending_curves = False
+        self.pending_crosshair = False
+    
     def parse_function(self, func_str):
         """Парсинг строки функции с обработкой ошибок"""
-        original_str = func_str
         try:
-            # Заменяем математические обозначения
-            func_str = func_str.replace('^', '**')
-            func_str = func_str.replace('sin', 'np.sin')
-            func_str = func_str.replace('cos', 'np.cos')
-            func_str = func_str.replace('tan', 'np.tan')
-            func_str = func_str.replace('exp', 'np.exp')
-            func_str = func_str.replace('log', 'np.log')
-            func_str = func_str.replace('sqrt', 'np.sqrt')
-            func_str = func_str.replace('abs', 'np.abs')
-            
-            # Проверяем наличие np. для математических функций
-            if 'np.' not in func_str and any(op in func_str for op in ['sin', 'cos', 'tan', 'exp', 'log', 'sqrt']):
-                for func in ['sin', 'cos', 'tan', 'exp', 'log', 'sqrt']:
-                    func_str = func_str.replace(func, f'np.{func}')
-            
-            # Создаем лямбда-функцию
-            func = lambda x: eval(func_str)
+            # Разбор и компиляция один раз (с кэшем), без eval строки на каждом вызове
+            func = compile_expression(func_str)
             # Тестируем функцию
-            test_val = func(0)
-            self.function_str = original_str
+            with np.errstate(all='ignore'):
+                func(np.array([0.0, 1.0]))
+            self.function_str = func_str
             return func
         except Exception as e:
             print(f"Ошибка в функции: {e}")
             return self.current_function
     
     def calculate_derivative(self, x):
-        """Вычисление производной"""
+        """Вычисление производной (x - число или массив).
+        
+        Символьная производная, если ее удалось построить и посчитать,
+        иначе численная (numerical_derivative порядка derivative_order).
+        """
+        try:
+            return evaluate(self.current_function.derivative, x)
+        except Exception:
+            pass
         try:
             return self.numerical_derivative(self.current_function, x)
         except:
-            return 0
+            return np.zeros_like(x, dtype=float)
     
     def calculate_integral(self, x):
-        """Вычисление интеграла от -5 до x"""
+        """Вычисление интеграла от -5 до x.
+        
+        Через символьную первообразную F(x) - F(-5), если она найдена;
+        иначе для числа - quad, для отсортированного массива - накопленный
+        интеграл по всей сетке сразу (cumulative_integral). За первой точкой,
+        где f не определена или уходит в бесконечность, интеграл расходится
+        и результат - NaN.
+        """
         try:
-            result, _ = integrate.quad(self.current_function, -5, x)
-            return result
+            F = getattr(self.current_function, 'antiderivative', None)
+            if F is not None:
+                result = evaluate(F, x) - F(-5.0)
+            elif np.ndim(x) == 0:
+                result, _ = integrate.quad(self.current_function, -5, x)
+            else:
+                result = cumulative_integral(self.current_function, x, lower=-5)
         except:
-            return 0
+            return np.zeros_like(x, dtype=float)
+        return self.mask_divergent_integral(x, result)
+    
+    def mask_divergent_integral(self, x, values):
+        """NaN для x, отделенных от нижнего предела -5 особой точкой f"""
+        # Отрезок поиска зависит только от диапазона графика и покрывает
+        # нижний предел -5 и весь слайдер точки (-5..5)
+        span = max(5.0, self.x_range)
+        key = (self.current_function, span)
+        if self.singular_cache[0] != key:
+            self.singular_cache = (key, singular_points(self.current_function, -span, span))
+        singular = self.singular_cache[1]
+        
+        right = singular[singular >= -5.0]
+        left = singular[singular <= -5.0]
+        first_right = right.min() if right.size else np.inf
+        first_left = left.max() if left.size else -np.inf
+        divergent = (x >= first_right) | (x <= first_left)
+        return np.where(divergent, np.nan, values) if np.ndim(x) else (np.nan if divergent else values)
     
     def update_function(self, text):
         """Обновление функции"""
         self.current_function = self.parse_function(text)
-        self.update_plots()
+        self.schedule_update(curves=True)
     
     def update_range(self, val):
         """Обновление диапазона"""
         range_val = self.range_slider.val
-        self.x = np.linspace(-range_val, range_val, 1000)
+        self.x_range = range_val
         
         for ax in [self.ax_func, self.ax_deriv, self.ax_integral]:
             ax.set_xlim(-range_val, range_val)
         
-        self.update_plots()
+        self.schedule_update(curves=True)
+    
+    def compute_curves(self):
+        """Функция, производная и интеграл на адаптивной сетке.
+        
+        Возвращает (x, f, f', F); в точках разрыва и вне области
+        определения все три кривые - NaN.
+        """
+        with np.errstate(all='ignore'):
+            self.x, y_func = adaptive_sample(self.current_function, -self.x_range, self.x_range,
+                                             budget=self.sample_budget)
+            y_deriv = np.array(self.calculate_derivative(self.x), dtype=float)
+            y_integral = np.array(self.calculate_integral(self.x), dtype=float)
+        gaps = ~np.isfinite(y_func)
+        y_deriv[gaps] = np.nan
+        y_integral[gaps] = np.nan
+        return self.x, y_func, y_deriv, y_integral
+    
+    def set_curve_ylim(self, ax, x, y):
+        """Пределы по y с отступом 10%; выбросы у полюсов не растягивают ось.
+        
+        Процентили взвешены длиной участков сетки, иначе сгущение точек
+        у полюса смещало бы их к большим значениям.
+        """
+        limits = weighted_percentile(x, y, [0.05, 0.95])
+        if limits is None:
+            ax.set_ylim(-1, 1)
+            return
+        low, high = limits
+        finite = y[np.isfinite(y)]
+        spread = high - low if high > low else 1.0
+        y_min = max(np.min(finite), low - spread)
+        y_max = min(np.max(finite), high + spread)
+        y_range = y_max - y_min if y_max != y_min else 2
+        ax.set_ylim(y_min - 0.1*y_range, y_max + 0.1*y_range)
     
     def update_plots(self):
         """Обновление всех графиков"""
-        # Функция
-        y_func = self.current_function(self.x)
-        self.func_line.set_data(self.x, y_func)
-        y_range = np.max(y_func) - np.min(y_func) if len(y_func) > 0 else 1
-        y_min = np.min(y_func) if len(y_func) > 0 else -1
-        y_max = np.max(y_func) if len(y_func) > 0 else 1
-        self.ax_func.set_ylim(y_min - 0.1*y_range, y_max + 0.1*y_range)
-        
-        # Производная
-        y_deriv = np.array([self.calculate_derivative(xi) for xi in self.x])
-        self.deriv_line.set_data(self.x, y_deriv)
-        if len(y_deriv) > 0:
-            y_deriv_range = np.max(y_deriv) - np.min(y_deriv) if np.max(y_deriv) != np.min(y_deriv) else 2
-            y_deriv_min = np.min(y_deriv)
-            y_deriv_max = np.max(y_deriv)
-            self.ax_deriv.set_ylim(y_deriv_min - 0.1*y_deriv_range, 
-                                 y_deriv_max + 0.1*y_deriv_range)
-        
-        # Интеграл
-        y_integral = np.array([self.calculate_integral(xi) for xi in self.x])
-        self.integral_line.set_data(self.x, y_integral)
-        if len(y_integral) > 0:
-            y_integral_range = np.max(y_integral) - np.min(y_integral) if np.max(y_integral) != np.min(y_integral) else 2
-            y_integral_min = np.min(y_integral)
-            y_integral_max = np.max(y_integral)
-            self.ax_integral.set_ylim(y_integral_min - 0.1*y_integral_range, 
-                                    y_integral_max + 0.1*y_integral_range)
+        self.curves = self.compute_curves()
+        x, y_func, y_deriv, y_integral = self.curves
+        
+        for line, ax, y in [(self.func_line, self.ax_func, y_func),
+                            (self.deriv_line, self.ax_deriv, y_deriv),
+                            (self.integral_line, self.ax_integral, y_integral)]:
+            line.set_data(x, y)
+            self.set_curve_ylim(ax, x, y)
         
         self.update_crosshair(self.slider.val)
         self.fig.canvas.draw_idle()
     
     def update_crosshair(self, val):
-        """Обновление перекрестия и точек"""
+        """Обновление перекрестия и точек (без перерисовки).
+        
+        Дешевая операция: f и f' считаются в одной точке, численный интеграл
+        берется из уже построенной кривой в ближайшем узле слева плюс короткий
+        quad до x, а не отдельным quad от -5.
+        """
         if val is None:
             return
             
@@ -241,7 +912,13 @@ class CalculusGrapher:
         # Обновление точек
         y_func = self.current_function(x_point)
         y_deriv = self.calculate_derivative(x_point)
-        y_integral = self.calculate_integral(x_point)
+        curve_x, _, _, curve_integral = self.curves
+        numeric_integral = getattr(self.current_function, 'antiderivative', None) is None
+        if numeric_integral and curve_x[0] <= x_point <= curve_x[-1]:
+            k = max(np.searchsorted(curve_x, x_point, side='right') - 1, 0)
+            y_integral = curve_integral[k] + integrate.quad(self.current_function, curve_x[k], x_point)[0]
+        else:
+            y_integral = self.calculate_integral(x_point)
         
         self.point_func.set_data([x_point], [y_func])
         self.point_deriv.set_data([x_point], [y_deriv])
@@ -251,7 +928,6 @@ class CalculusGrapher:
         self.update_tangent(x_point, y_func, y_deriv)
         
         self.update_info(x_point, y_func, y_deriv, y_integral)
-        self.fig.canvas.draw_idle()
     
     def update_tangent(self, x_point, y_func, derivative):
         """Обновление линии касательной"""
@@ -269,6 +945,11 @@ class CalculusGrapher:
                 f'∫f(x)dx = {y_integral:.3f}\n\n'
                 f'ТЕКУЩАЯ ФУНКЦИЯ:\n{self.function_str}')
         
+        if isinstance(self.current_function, CompiledFunction):
+            antiderivative = self.current_function.antiderivative
+            info += (f"\n\nf'(x) = {self.current_function.derivative.source}\n"
+                     f"F(x) = {antiderivative.source if antiderivative else 'численно'}")
+        
         self.info_text.set_text(info)
     
     def select_preset(self, label):
@@ -313,6 +994,9 @@ class CalculusGrapher:
             t = (frame / 200) * 2 * np.pi
             x_point = 4 * np.sin(t)
             self.slider.set_val(x_point)
+            # Кадр перерисует FuncAnimation: перекрестие обновляется сразу,
+            # без второй отложенной перерисовки через 16 мс
+            self.flush_updates(draw=False)
     
     def reset_view(self, event):
         """Сброс вида"""
@@ -333,6 +1017,10 @@ if __name__ == "__main__":
     print("- Управление функцией: правая панель") 
     print("- Слайдеры и кнопки: нижняя панель")
     
+    # Раскомментируйте для проверки накопленного интеграла по quad:
+    # for expr in [np.sin, np.exp, lambda x: 1/(1+x**2), lambda x: np.sqrt(np.abs(x))]:
+    #     print(check_integral_accuracy(expr, np.linspace(-10, 10, 1000)))
+    
     try:
         grapher = CalculusGrapher()
         plt.show()